@@ -0,0 +1,157 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from schema import compact
+from tenant_cache import get_tenant_cache
+
+
+# Columns that may hold the mailing ZIP, depending on the upload template
+ZIP_COLUMNS = ('data_row.ma-zip', 'data_row.Property Zip', 'ma-zip')
+# Columns that tell scanners apart, the first one present is used
+SCANNER_COLUMNS = ('ip', 'user_agent', 'path')
+# Running stats are kept per campaign for a day, dropped sooner under pressure
+STATS_TTL = 24 * 60 * 60
+MAX_CAMPAIGN_STATS = 64
+STATS_MAX_BYTES = 256 * 1024 * 1024
+
+
+def contacts_frame(records):
+  """Typed frame for /records payloads, one row per contact"""
+  df = pd.json_normalize(records) if not isinstance(records, pd.DataFrame) else records
+  if df.empty:
+    return pd.DataFrame({'id': pd.Series(dtype='string'), 'timestamp': pd.Series(dtype='datetime64[ns, UTC]')})
+  return compact(df, 'records')
+
+
+def visits_frame(records):
+  """Typed frame for /logs and /related payloads, one row per visit"""
+  df = pd.json_normalize(records) if not isinstance(records, pd.DataFrame) else records
+  if df.empty:
+    return pd.DataFrame({'path': pd.Series(dtype='string'), 'timestamp': pd.Series(dtype='datetime64[ns, UTC]')})
+  return compact(df, 'logs')
+
+
+def visits_per_day(visits):
+  return visits['timestamp'].dt.floor('D').value_counts().sort_index()
+
+
+def visits_per_hour(visits):
+  return pd.Series(np.bincount(visits['timestamp'].dt.hour.dropna().astype(int), minlength=24), index=range(24))
+
+
+def scanner_column(visits):
+  return next((col for col in SCANNER_COLUMNS if col in visits), None)
+
+
+def zip_column(contacts):
+  return next((col for col in ZIP_COLUMNS if col in contacts), None)
+
+
+class CampaignStats:
+  """
+  Running aggregates for one campaign. update() only folds in visits it has
+  not seen yet, so refreshing with a grown visit log costs the new rows.
+  """
+
+  def __init__(self, contacts, total_contacts=None):
+    self.contacts = contacts
+    self.total_contacts = total_contacts or len(contacts)
+    self.visits = 0
+    self.by_day = pd.Series(dtype='int64')
+    self.by_hour = pd.Series(0, index=range(24), dtype='int64')
+    self.first_scan = pd.Series(dtype='datetime64[ns, UTC]')
+    self.scanners = set()
+    self.last_scan = None
+    self._seen = set()
+    self._lock = threading.Lock()
+
+  def update(self, visits):
+    if visits.empty:
+      return self
+    digests = pd.util.hash_pandas_object(visits, index=False).to_numpy()
+    with self._lock:
+      new = np.fromiter((d not in self._seen for d in digests.tolist()), bool, len(digests))
+      if not new.any():
+        return self
+      self._seen.update(digests[new].tolist())
+      visits = visits[new]
+
+      self.visits += len(visits)
+      self.by_day = self.by_day.add(visits_per_day(visits), fill_value=0).astype('int64')
+      self.by_hour = self.by_hour + visits_per_hour(visits)
+      first = visits.groupby('path', observed=True)['timestamp'].min()
+      if self.first_scan.empty:
+        self.first_scan = first
+      else:
+        self.first_scan = pd.concat([self.first_scan, first]).groupby(level=0).min()
+      latest = visits['timestamp'].max()
+      if pd.notna(latest) and (self.last_scan is None or latest > self.last_scan):
+        self.last_scan = latest
+      column = scanner_column(visits)
+      if column:
+        self.scanners.update(visits[column].dropna().unique().tolist())
+    return self
+
+  @property
+  def nbytes(self):
+    # The contact frame and the seen-visit digests dominate
+    return int(self.contacts.memory_usage(deep=True).sum()) + 64 * len(self._seen)
+
+  @property
+  def responded(self):
+    return int(self.contacts['id'].isin(self.first_scan.index).sum())
+
+  @property
+  def response_rate(self):
+    return self.responded / self.total_contacts if self.total_contacts else 0.0
+
+  def time_to_first_scan(self):
+    created = self.contacts.set_index('id')['timestamp']
+    delta = self.first_scan.reindex(created.index) - created
+    return delta.dropna()
+
+  def zip_breakdown(self):
+    column = zip_column(self.contacts)
+    if column is None:
+      return pd.DataFrame(columns=['contacts', 'responded', 'response rate'])
+    grouped = pd.DataFrame({
+      'zip': self.contacts[column].astype('string'),
+      'responded': self.contacts['id'].isin(self.first_scan.index),
+    }).groupby('zip', observed=True)['responded']
+    breakdown = pd.DataFrame({'contacts': grouped.size(), 'responded': grouped.sum().astype('int64')})
+    breakdown['response rate'] = breakdown['responded'] / breakdown['contacts']
+    return breakdown.sort_values('contacts', ascending=False)
+
+  def summary(self):
+    delays = self.time_to_first_scan()
+    return {
+      'contacts': self.total_contacts,
+      'responded': self.responded,
+      'response rate': self.response_rate,
+      'visits': self.visits,
+      'unique scanners': len(self.scanners),
+      'median time to first scan': delays.median() if not delays.empty else None,
+      'last scan': self.last_scan,
+    }
+
+
+class StatsRegistry:
+  def __init__(self):
+    self._stats = get_tenant_cache('campaign_stats', STATS_TTL, MAX_CAMPAIGN_STATS, STATS_MAX_BYTES)
+    self._lock = threading.Lock()
+
+  def get(self, tenant, key, contacts, total_contacts=None):
+    """Stats for key, rebuilt only when the campaign's contact list changed"""
+    with self._lock:
+      stats = self._stats.get(tenant, key)
+      if stats is None or len(stats.contacts) != len(contacts) or stats.total_contacts != (total_contacts or len(contacts)):
+        stats = self._stats.put(tenant, key, CampaignStats(contacts, total_contacts))
+      return stats
+
+
+@st.cache_resource
+def get_stats_registry():
+  return StatsRegistry()
@@ -0,0 +1,321 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import urlsplit
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+
+from json_stream import CHUNK_SIZE, iter_records, records_frame
+from tenant_cache import get_tenant_cache, sizeof
+
+
+# (connect, read) timeouts in seconds for every backend call
+DEFAULT_TIMEOUT = (3.05, 30)
+# Connections kept alive per host
+POOL_MAXSIZE = 16
+# Retries are bounded and back off 0.5s, 1s, 2s ...
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Requests in flight per backend host, across all sessions of the process
+HOST_CONCURRENCY = int(os.environ.get('HOST_CONCURRENCY', 8))
+# Of those, how many background work may use (bulk uploads, prefetching,
+# summaries, warming), the rest stay free for pages
+BACKGROUND_CONCURRENCY = int(os.environ.get('BACKGROUND_CONCURRENCY', HOST_CONCURRENCY // 2))
+# Seconds a call waits for a free slot before failing with HostBusyError.
+# Background calls queue behind slow bulk POSTs, so they wait longer
+SLOT_TIMEOUT = float(os.environ.get('SLOT_TIMEOUT', 30))
+BACKGROUND_SLOT_TIMEOUT = float(os.environ.get('BACKGROUND_SLOT_TIMEOUT', 600))
+# Consecutive failures that open a host's circuit, and seconds it stays open
+BREAKER_THRESHOLD = int(os.environ.get('BREAKER_THRESHOLD', 5))
+BREAKER_COOLDOWN = float(os.environ.get('BREAKER_COOLDOWN', 30))
+# Parsed bodies kept per host to answer 304 Not Modified from
+REVALIDATE_TTL = 24 * 60 * 60
+REVALIDATE_MAX_ENTRIES = 2048
+REVALIDATE_MAX_BYTES = int(os.environ.get('REVALIDATE_MAX_BYTES', 256 * 1024 * 1024))
+
+
+def base_url(host):
+  return f'https://{host}' if '://' not in host else host.rstrip('/')
+
+
+def revalidation_tenant(host, secret_key):
+  """Tenant the revalidated bodies of a host and secret key are cached under, see invalidate_tenant"""
+  return ('http', base_url(host), secret_key)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+  """The host failed repeatedly and is not called until its cooldown ends"""
+
+
+class HostBusyError(requests.exceptions.ConnectionError):
+  """No slot to call the host freed up in time, the request was not sent"""
+
+
+class ApiError(requests.exceptions.HTTPError):
+  """The backend answered with an error status, str() is the message of its body"""
+
+
+def raise_for_status(response):
+  """ApiError for a 4xx or 5xx response, with the backend's message when the body has one"""
+  try:
+    response.raise_for_status()
+  except requests.exceptions.HTTPError as e:
+    try:
+      body = response.json()
+    except ValueError:
+      body = None
+    message = body.get('message') if isinstance(body, dict) else None
+    raise ApiError(message or str(e), response=response) from e
+
+
+class HostGuard:
+  """
+  Concurrency limit and circuit breaker for one backend host.
+
+  Background calls (see run_in_background) hold one of background_limit
+  slots on top of a host slot, so they never take every slot from pages.
+  A call that gets no slot within its timeout raises HostBusyError.
+
+  After threshold consecutive failures (errors or 5xx responses) calls
+  fail fast with CircuitOpenError. Once the cooldown is over a single
+  probe goes through, and its outcome closes or re-opens the circuit.
+  """
+
+  def __init__(self, host, limit=HOST_CONCURRENCY, background_limit=BACKGROUND_CONCURRENCY,
+               threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+    self.host = host
+    self.threshold = threshold
+    self.cooldown = cooldown
+    self.failures = 0
+    self.opened_at = None
+    self._probing = False
+    self._slots = threading.BoundedSemaphore(limit)
+    self._background_slots = threading.BoundedSemaphore(max(1, min(background_limit, limit)))
+    self._lock = threading.Lock()
+
+  def _acquire(self, background):
+    timeout = BACKGROUND_SLOT_TIMEOUT if background else SLOT_TIMEOUT
+    deadline = time.monotonic() + timeout
+    if background and not self._background_slots.acquire(timeout=timeout):
+      raise HostBusyError(f'{self.host} has had no free background slot for {timeout:.0f}s')
+    if not self._slots.acquire(timeout=max(0, deadline - time.monotonic())):
+      if background:
+        self._background_slots.release()
+      raise HostBusyError(f'{self.host} has had no free slot for {timeout:.0f}s')
+
+  def enter(self, background=False):
+    with self._lock:
+      if self.opened_at is not None:
+        if self._probing or time.monotonic() < self.opened_at + self.cooldown:
+          raise CircuitOpenError(f'{self.host} is failing, not calling it for a while')
+        self._probing = True
+    try:
+      self._acquire(background)
+    except HostBusyError:
+      with self._lock:
+        self._probing = False
+      raise
+
+  def exit(self, ok, background=False):
+    self._slots.release()
+    if background:
+      self._background_slots.release()
+    with self._lock:
+      self._probing = False
+      if ok:
+        self.failures = 0
+        self.opened_at = None
+      else:
+        self.failures += 1
+        if self.failures >= self.threshold:
+          self.opened_at = time.monotonic()
+
+
+_calls = threading.local()
+
+
+def run_in_background():
+  """
+  Marks the backend calls of the current thread as background work. Used
+  as the initializer of the thread pools that upload, prefetch or warm.
+  """
+  _calls.background = True
+
+
+class SingleFlight:
+  """Concurrent calls with the same key share the first caller's result"""
+
+  def __init__(self):
+    self._calls = {}
+    self._lock = threading.Lock()
+
+  def do(self, key, fn):
+    with self._lock:
+      call = self._calls.get(key)
+      leader = call is None
+      if leader:
+        call = self._calls[key] = Future()
+    if not leader:
+      return call.result()
+    try:
+      result = fn()
+      call.set_result(result)
+      return result
+    except BaseException as e:
+      call.set_exception(e)
+      raise
+    finally:
+      with self._lock:
+        del self._calls[key]
+
+
+def _request_key(method, url, kwargs):
+  key = [method, url]
+  for name, value in sorted(kwargs.items()):
+    if name == 'timeout':
+      continue
+    if isinstance(value, dict):
+      value = tuple(sorted((k, str(v)) for k, v in value.items()))
+    key.append((name, repr(value)))
+  return tuple(key)
+
+
+class ApiClient:
+  """Pooled HTTP client shared by all pages for backend calls"""
+
+  def __init__(self, timeout=DEFAULT_TIMEOUT, pool_maxsize=POOL_MAXSIZE, retries=RETRY_TOTAL):
+    self.timeout = timeout
+    self.session = requests.Session()
+    # Every encoding urllib3 can decode here: gzip and deflate, plus br
+    # and zstd when brotli or zstandard are installed
+    self.session.headers.update({'Accept-Encoding': ACCEPT_ENCODING})
+    # Connection errors are retried for any method, read errors and bad
+    # statuses only for idempotent ones so a POST is never replayed
+    retry = Retry(
+      total=retries,
+      connect=retries,
+      read=retries,
+      status=retries,
+      backoff_factor=RETRY_BACKOFF,
+      status_forcelist=RETRY_STATUSES,
+      allowed_methods=frozenset({'GET', 'HEAD', 'OPTIONS'}),
+      raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+      pool_connections=POOL_MAXSIZE,
+      pool_maxsize=pool_maxsize,
+      max_retries=retry,
+    )
+    self.session.mount('https://', adapter)
+    self.session.mount('http://', adapter)
+    self._flights = SingleFlight()
+    self._guards = {}
+    self._guards_lock = threading.Lock()
+
+  def guard(self, url):
+    host = urlsplit(url).netloc
+    with self._guards_lock:
+      if host not in self._guards:
+        self._guards[host] = HostGuard(host)
+      return self._guards[host]
+
+  def _guarded(self, url, call):
+    guard = self.guard(url)
+    background = getattr(_calls, 'background', False)
+    guard.enter(background)
+    ok = False
+    try:
+      response = call()
+      ok = response.status_code < 500
+      return response
+    finally:
+      guard.exit(ok, background)
+
+  def request(self, method, url, **kwargs):
+    kwargs.setdefault('timeout', self.timeout)
+    call = lambda: self._guarded(url, lambda: self.session.request(method, url, **kwargs))
+    # Identical GETs already in flight, from any session, share one response
+    if method == 'GET' and not kwargs.get('stream'):
+      return self._flights.do(_request_key(method, url, kwargs), call)
+    return call()
+
+  def send(self, prepped, **kwargs):
+    kwargs.setdefault('timeout', self.timeout)
+    return self._guarded(prepped.url, lambda: self.session.send(prepped, **kwargs))
+
+  def get(self, host, path, params=None, **kwargs):
+    return self.request('GET', f'{base_url(host)}/{path.lstrip("/")}', params=params, **kwargs)
+
+  def _revalidated(self, host, path, params, kind, parse):
+    """
+    GET url and parse(response) the body, unless the server answers 304 to
+    the validators of the last parsed body, which is then returned as is.
+    Any other status raises ApiError and nothing is cached.
+    """
+    cache = get_tenant_cache('http_revalidation', REVALIDATE_TTL, REVALIDATE_MAX_ENTRIES, REVALIDATE_MAX_BYTES)
+    url = f'{base_url(host)}/{path.lstrip("/")}'
+    tenant = revalidation_tenant(host, (params or {}).get('secret_key'))
+    key = _request_key('GET', url, {'params': params, 'kind': kind})
+
+    def fetch():
+      cached = cache.get(tenant, key)
+      headers = {}
+      if cached:
+        if cached[0]:
+          headers['If-None-Match'] = cached[0]
+        if cached[1]:
+          headers['If-Modified-Since'] = cached[1]
+      with self._guarded(url, lambda: self.session.get(
+        url, params=params, headers=headers, stream=True, timeout=self.timeout
+      )) as response:
+        if response.status_code == 304 and cached:
+          return cached[2]
+        if response.status_code != 200:
+          raise_for_status(response)
+          raise ApiError(f'Unexpected {response.status_code} response from {url}', response=response)
+        result = parse(response)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+          cache.put(tenant, key, (etag, last_modified, result), size=sizeof(result))
+        return result
+
+    return self._flights.do(key, fetch)
+
+  def holds(self, host, secret_key, body):
+    """Whether the revalidation cache keeps body, which its byte budget then covers"""
+    cache = get_tenant_cache('http_revalidation', REVALIDATE_TTL, REVALIDATE_MAX_ENTRIES, REVALIDATE_MAX_BYTES)
+    return cache.holds(revalidation_tenant(host, secret_key), lambda entry: entry[2] is body)
+
+  def get_json(self, host, path, params=None):
+    """Parsed JSON body of a GET, revalidated against the last one fetched"""
+    return self._revalidated(host, path, params, 'json', lambda response: response.json())
+
+  def get_frame(self, host, path, params=None, key='records', flatten=False, schema=None):
+    """
+    DataFrame of a list endpoint's records, parsed straight from the
+    compressed stream into columns and revalidated like get_json. With a
+    schema (see schema.SCHEMAS) the frame is compacted before it is cached.
+    """
+    def parse(response):
+      from schema import compact
+
+      frame = records_frame(iter_records(response.iter_content(CHUNK_SIZE), key), flatten)
+      return compact(frame, schema) if schema else frame
+
+    return self._revalidated(host, path, params, ('frame', key, flatten, schema), parse)
+
+  def post(self, host, path, **kwargs):
+    return self.request('POST', f'{base_url(host)}/{path.lstrip("/")}', **kwargs)
+
+
+# One client per process, shared across sessions and reruns
+@st.cache_resource
+def get_client():
+  return ApiClient()
@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import streamlit as st
+
+
+ARTIFACT_ROOT = os.environ.get('ARTIFACT_DIR', os.path.join(tempfile.gettempdir(), 'artifacts'))
+# Disk budget for all exports on the container
+MAX_TOTAL_BYTES = int(os.environ.get('ARTIFACT_MAX_BYTES', 2 * 1024 ** 3))
+# Disk budget for a single session or job
+MAX_WORKSPACE_BYTES = int(os.environ.get('ARTIFACT_WORKSPACE_MAX_BYTES', 1024 ** 3))
+# Exports not touched for this many seconds are removed
+ARTIFACT_TTL = int(os.environ.get('ARTIFACT_TTL', 24 * 60 * 60))
+
+
+class ArtifactQuotaError(Exception):
+  pass
+
+
+def _dir_size(path):
+  total = 0
+  for dirpath, _, filenames in os.walk(path):
+    for filename in filenames:
+      try:
+        total += os.path.getsize(os.path.join(dirpath, filename))
+      except OSError:
+        pass
+  return total
+
+
+class ArtifactStore:
+  """
+  Directory per session or job for generated files.
+
+  Files are written under a temporary name and renamed into place once
+  complete, so readers never see a partial export. Reading a file marks it
+  as recently used, and eviction drops expired files first and then the
+  least recently used ones until the store fits its disk budget.
+  """
+
+  def __init__(self, root=ARTIFACT_ROOT, max_bytes=MAX_TOTAL_BYTES,
+               max_workspace_bytes=MAX_WORKSPACE_BYTES, ttl=ARTIFACT_TTL):
+    self.root = root
+    self.max_bytes = max_bytes
+    self.max_workspace_bytes = max_workspace_bytes
+    self.ttl = ttl
+    self._lock = threading.Lock()
+    os.makedirs(self.root, exist_ok=True)
+
+  def workspace(self, owner):
+    path = os.path.join(self.root, owner)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+  @contextmanager
+  def create(self, owner, name, mode='wb'):
+    """Yields a file to write, which becomes visible as name only on success"""
+    workspace = self.workspace(owner)
+    final_path = os.path.join(workspace, name)
+    tmp_path = os.path.join(workspace, f'.{name}.{uuid.uuid4().hex}.tmp')
+    try:
+      with open(tmp_path, mode) as fp:
+        yield fp
+        fp.flush()
+        os.fsync(fp.fileno())
+      if _dir_size(workspace) > self.max_workspace_bytes:
+        raise ArtifactQuotaError(f'Export {name} is over the {self.max_workspace_bytes} byte limit')
+      os.replace(tmp_path, final_path)
+    finally:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    self.evict(keep=final_path)
+
+  def path(self, owner, name):
+    """Path of a finished artifact, or None if it was never made or got evicted"""
+    path = os.path.join(self.root, owner, name)
+    try:
+      os.utime(path)
+    except FileNotFoundError:
+      return None
+    return path
+
+  def remove(self, owner):
+    shutil.rmtree(os.path.join(self.root, owner), ignore_errors=True)
+
+  def evict(self, keep=None):
+    with self._lock:
+      now = time.time()
+      files = []
+      for dirpath, _, filenames in os.walk(self.root):
+        for filename in filenames:
+          path = os.path.join(dirpath, filename)
+          try:
+            stat = os.stat(path)
+          except OSError:
+            continue
+          if stat.st_mtime < now - self.ttl:
+            os.remove(path)
+          else:
+            files.append((stat.st_mtime, stat.st_size, path))
+
+      total = sum(size for _, size, _ in files)
+      for _, size, path in sorted(files):
+        if total <= self.max_bytes:
+          break
+        # Files still being written are never evicted, they're bounded by the workspace quota
+        if path == keep or path.endswith('.tmp'):
+          continue
+        try:
+          os.remove(path)
+        except OSError:
+          continue
+        total -= size
+
+      for entry in os.scandir(self.root):
+        # Leave fresh directories alone, a writer may be about to use them
+        if entry.is_dir() and entry.stat().st_mtime < now - 60 and not os.listdir(entry.path):
+          os.rmdir(entry.path)
+
+
+@st.cache_resource
+def get_store():
+  store = ArtifactStore()
+  # Clears whatever a previous container process left behind
+  store.evict()
+  return store
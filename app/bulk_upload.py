@@ -0,0 +1,159 @@
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import requests
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, NewConnectionError
+
+from api_client import CircuitOpenError, HostBusyError, get_client, run_in_background
+from artifacts import get_store
+
+
+# Rows per POST to /bulk
+CHUNK_ROWS = 2000
+# Chunks in flight at once
+MAX_PARALLEL = 4
+CHUNK_RETRIES = 3
+RETRY_BACKOFF = 1.0
+# Bulk processing is slow server side, allow a longer read timeout
+BULK_TIMEOUT = (3.05, 300)
+
+
+class ChunkError(Exception):
+  pass
+
+
+def split_csv(csv_bytes, chunk_rows=CHUNK_ROWS):
+  """Splits a CSV into chunks of rows, each with its own header line"""
+  # Read everything as text so values reach the API exactly as uploaded
+  reader = pd.read_csv(
+    io.BytesIO(csv_bytes),
+    dtype=str,
+    keep_default_na=False,
+    chunksize=chunk_rows
+  )
+  return [chunk.to_csv(index=False).encode('utf-8') for chunk in reader]
+
+
+class UploadCheckpoint:
+  """Keeps every successful chunk response on disk until the upload completes"""
+
+  def __init__(self, host, csv_bytes, payload, chunk_rows=CHUNK_ROWS):
+    # Chunk responses hold URLs that only exist on the backend that made them
+    key = hashlib.sha256(host.encode('utf-8'))
+    key.update(csv_bytes)
+    key.update(json.dumps(payload, sort_keys=True).encode('utf-8'))
+    key.update(str(chunk_rows).encode('utf-8'))
+    # Abandoned checkpoints expire with the rest of the artifact store
+    self.owner = f'upload-{key.hexdigest()}'
+    self.path = get_store().workspace(self.owner)
+
+  def _chunk_path(self, index):
+    return os.path.join(self.path, f'chunk_{index:06d}.json')
+
+  def done(self, index):
+    return os.path.exists(self._chunk_path(index))
+
+  def save(self, index, records):
+    tmp_path = f'{self._chunk_path(index)}.tmp'
+    with open(tmp_path, 'w') as fp:
+      json.dump(records, fp)
+    os.replace(tmp_path, self._chunk_path(index))
+
+  def load(self, index):
+    with open(self._chunk_path(index)) as fp:
+      return json.load(fp)
+
+  def clear(self):
+    get_store().remove(self.owner)
+
+
+def _not_sent(error):
+  """Whether a ConnectionError happened before any of the request could reach the server"""
+  if isinstance(error, (requests.exceptions.ConnectTimeout, CircuitOpenError, HostBusyError)):
+    return True
+  reason = error.args[0] if error.args else None
+  if isinstance(reason, MaxRetryError):
+    reason = reason.reason
+  # NewConnectionError covers refused connections and failed name lookups
+  return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+def post_chunk(host, payload, index, chunk, retries=CHUNK_RETRIES):
+  """
+  Posts one chunk. It is only sent again when the server can't have
+  processed it: no connection could be made, the host guard held it
+  back, or the request was rate limited.
+  """
+  client = get_client()
+  last_error = None
+  for attempt in range(retries + 1):
+    if attempt:
+      time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+    try:
+      response = client.post(
+        host,
+        'bulk',
+        data=payload,
+        files={'file': (f'chunk_{index}.csv', chunk, 'text/csv')},
+        timeout=BULK_TIMEOUT
+      )
+    except requests.exceptions.ReadTimeout:
+      # The server may have created the chunk's URLs, resending would duplicate them
+      raise ChunkError(f'Chunk {index + 1} failed: no response within {BULK_TIMEOUT[1]}s, it may have been processed')
+    except requests.exceptions.ConnectionError as e:
+      if not _not_sent(e):
+        # Reset or aborted after the body went out, resending could duplicate the chunk's URLs
+        raise ChunkError(f'Chunk {index + 1} failed, outcome unknown, it may have been processed: {e}')
+      last_error = str(e)
+      continue
+    except requests.exceptions.RequestException as e:
+      raise ChunkError(f'Chunk {index + 1} failed: {e}')
+    if response.status_code == 200:
+      return response.json()
+    last_error = response.text
+    if response.status_code != 429:
+      break
+  raise ChunkError(f'Chunk {index + 1} failed: {last_error}')
+
+
+def upload_in_chunks(host, csv_bytes, payload, chunk_rows=CHUNK_ROWS,
+                     max_parallel=MAX_PARALLEL, on_progress=None):
+  """
+  Posts the CSV to /bulk in row chunks with bounded parallelism.
+
+  Returns (DataFrame of merged results in row order, list of errors). Chunks
+  that already succeeded in an earlier attempt are loaded from the checkpoint
+  instead of being sent again.
+  """
+  chunks = split_csv(csv_bytes, chunk_rows)
+  checkpoint = UploadCheckpoint(host, csv_bytes, payload, chunk_rows)
+  pending = [i for i in range(len(chunks)) if not checkpoint.done(i)]
+  completed = len(chunks) - len(pending)
+  errors = []
+
+  if on_progress:
+    on_progress(completed, len(chunks))
+  with ThreadPoolExecutor(max_workers=max_parallel, initializer=run_in_background) as pool:
+    futures = {pool.submit(post_chunk, host, payload, i, chunks[i]): i for i in pending}
+    for future in as_completed(futures):
+      try:
+        checkpoint.save(futures[future], future.result())
+        completed += 1
+      except ChunkError as e:
+        errors.append(str(e))
+      if on_progress:
+        on_progress(completed, len(chunks))
+
+  if errors:
+    return None, errors
+
+  frames = [pd.DataFrame(checkpoint.load(i)) for i in range(len(chunks))]
+  checkpoint.clear()
+  if not frames:
+    return pd.DataFrame(), errors
+  return pd.concat(frames, ignore_index=True), errors
@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+
+import streamlit as st
+
+from api_client import get_client, run_in_background
+
+
+# Seconds between background refreshes of the catalogs in use
+CATALOG_REFRESH = int(os.environ.get('CATALOG_REFRESH', 60))
+# Catalogs nobody read for this long stop being refreshed
+CATALOG_IDLE = 10 * 60
+
+
+class TenantCatalog:
+  def __init__(self):
+    self.body = None
+    self.stale = True
+    self.fetched_at = 0.0
+    self.read_at = time.time()
+    self.lock = threading.Lock()
+
+
+class CampaignCatalog:
+  """
+  Campaign list per (host, secret key), shared by every page and session.
+
+  Reads are answered from memory. /campaigns is only requested the first
+  time, after invalidate() (something changed the campaigns elsewhere) and
+  from the background refresh of catalogs read recently. add() writes a
+  newly created campaign straight into the catalog.
+  """
+
+  def __init__(self, refresh_interval=CATALOG_REFRESH):
+    self.refresh_interval = refresh_interval
+    self._tenants = {}
+    self._lock = threading.Lock()
+    self._refresher = None
+
+  def _tenant(self, host, secret_key):
+    with self._lock:
+      tenant = self._tenants.get((host, secret_key))
+      if tenant is None:
+        tenant = self._tenants[(host, secret_key)] = TenantCatalog()
+      if self._refresher is None and self.refresh_interval:
+        self._refresher = threading.Thread(target=self._refresh_loop, name='campaign-catalog', daemon=True)
+        self._refresher.start()
+      return tenant
+
+  def _fetch(self, host, secret_key, tenant):
+    tenant.body = get_client().get_json(host, 'campaigns', params={'secret_key': secret_key})
+    tenant.stale = False
+    tenant.fetched_at = time.time()
+
+  def get(self, host, secret_key):
+    """The /campaigns body: count and records, or a message"""
+    tenant = self._tenant(host, secret_key)
+    tenant.read_at = time.time()
+    # One fetch per tenant at a time, the others wait for its result
+    with tenant.lock:
+      if tenant.stale or tenant.body is None:
+        self._fetch(host, secret_key, tenant)
+      body = tenant.body
+    if isinstance(body, dict) and 'records' in body:
+      return dict(body, records=list(body['records']))
+    return body
+
+  def records(self, host, secret_key):
+    body = self.get(host, secret_key)
+    return (body or {}).get('records') or []
+
+  def add(self, host, secret_key, record):
+    """Writes a campaign the backend just created into the catalog"""
+    tenant = self._tenant(host, secret_key)
+    with tenant.lock:
+      body = tenant.body
+      if not isinstance(body, dict) or not body.get('records'):
+        # Nothing usable cached yet, the next read fetches the list with it
+        tenant.stale = True
+        return
+      if 'customer_id' not in record:
+        # Every campaign of a secret key belongs to the same customer
+        record = dict(record, customer_id=body['records'][0].get('customer_id'))
+      records = [r for r in body['records'] if r.get('name') != record.get('name')] + [record]
+      tenant.body = dict(body, records=records, count=len(records))
+
+  def refresh(self, host, secret_key):
+    """Fetches a catalog now, without counting as a read, and returns its records"""
+    tenant = self._tenant(host, secret_key)
+    with tenant.lock:
+      self._fetch(host, secret_key, tenant)
+      body = tenant.body
+    return list((body or {}).get('records') or [])
+
+  def invalidate(self, host, secret_key):
+    self._tenant(host, secret_key).stale = True
+
+  def _refresh_loop(self):
+    run_in_background()
+    while True:
+      time.sleep(self.refresh_interval)
+      now = time.time()
+      with self._lock:
+        tenants = list(self._tenants.items())
+      for (host, secret_key), tenant in tenants:
+        if tenant.read_at < now - CATALOG_IDLE or tenant.fetched_at > now - self.refresh_interval:
+          continue
+        try:
+          with tenant.lock:
+            self._fetch(host, secret_key, tenant)
+        except Exception:
+          traceback.print_exc()
+
+
+def created_record(payload, response):
+  """Catalog record for a campaign created with payload"""
+  try:
+    body = response.json()
+  except ValueError:
+    body = None
+  if isinstance(body, dict) and body.get('name') == payload.get('name'):
+    return body
+  return {
+    'name': payload.get('name'),
+    'destination_url': payload.get('destination_url'),
+    'total': 0,
+    'timestamp': datetime.now(timezone.utc).isoformat(),
+  }
+
+
+@st.cache_resource
+def get_campaign_catalog():
+  return CampaignCatalog()
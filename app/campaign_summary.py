@@ -0,0 +1,181 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import streamlit as st
+
+from analytics import contacts_frame, get_stats_registry, visits_frame
+from api_client import get_client, run_in_background
+
+
+SUMMARY_DB_PATH = os.environ.get(
+  'SUMMARY_DB_PATH', os.path.join(tempfile.gettempdir(), 'campaign_summaries.sqlite3')
+)
+# Summaries older than this are updated with the visits since, even if
+# the campaign looks unchanged: new scans don't change its fingerprint
+SUMMARY_TTL = int(os.environ.get('SUMMARY_TTL', 15 * 60))
+# Campaigns summarized at once in the background
+SUMMARY_WORKERS = 2
+# Tenants whose dashboard nobody opened for this long only get missing
+# summaries built by scheduled refreshes
+SUMMARY_IDLE = 10 * 60
+# /related requests in flight while summarizing one campaign
+VISIT_FETCH_WORKERS = 8
+SUMMARY_COLUMNS = ['contacts', 'responded', 'visits', 'last_scan', 'response_rate']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS campaign_summary (
+  host TEXT NOT NULL,
+  tenant TEXT NOT NULL,
+  campaign TEXT NOT NULL,
+  fingerprint TEXT,
+  contacts INTEGER,
+  responded INTEGER,
+  visits INTEGER,
+  last_scan TEXT,
+  response_rate REAL,
+  refreshed_at REAL,
+  PRIMARY KEY (host, tenant, campaign)
+);
+'''
+
+
+def fetch_contacts(host, secret_key, campaign):
+  params = {'secret_key': secret_key, 'campaign': campaign}
+  return get_client().get_frame(host, 'records', params=params, flatten=True, schema='records')
+
+
+def fetch_visits(host, secret_key, contact_ids):
+  def fetch(contact_id):
+    body = get_client().get_json(host, 'related', params={'secret_key': secret_key, 'path': contact_id})
+    return body.get('records') or []
+
+  with ThreadPoolExecutor(max_workers=VISIT_FETCH_WORKERS, initializer=run_in_background) as pool:
+    records = [record for batch in pool.map(fetch, contact_ids) for record in batch]
+  return visits_frame(records)
+
+
+def tenant_id(secret_key):
+  """Names a secret key's rows without writing the key to disk"""
+  return hashlib.sha256(secret_key.encode('utf-8')).hexdigest()
+
+
+def fingerprint(campaign):
+  """Changes whenever the campaign list reports a different contact count or timestamp"""
+  return f"{campaign.get('total')}|{campaign.get('timestamp')}"
+
+
+class SummaryStore:
+  """Campaign summaries per (host, secret key), tenants sharing a backend each have their own"""
+
+  def __init__(self, db_path=SUMMARY_DB_PATH):
+    self._lock = threading.Lock()
+    self._conn = sqlite3.connect(db_path, check_same_thread=False)
+    self._conn.execute('PRAGMA journal_mode=WAL')
+    columns = [row[1] for row in self._conn.execute('PRAGMA table_info(campaign_summary)')]
+    if columns and 'tenant' not in columns:
+      # Summaries from before they were kept per tenant, they are rebuilt
+      self._conn.execute('DROP TABLE campaign_summary')
+    self._conn.executescript(SCHEMA)
+
+  def put(self, host, secret_key, campaign, summary, campaign_fingerprint=None):
+    last_scan = summary.get('last scan')
+    row = (
+      host, tenant_id(secret_key), campaign, campaign_fingerprint,
+      summary['contacts'], summary['responded'], summary['visits'],
+      last_scan.isoformat() if last_scan is not None else None,
+      summary['response rate'], time.time()
+    )
+    with self._lock, self._conn:
+      self._conn.execute('INSERT OR REPLACE INTO campaign_summary VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+
+  def state(self, host, secret_key):
+    """campaign -> (fingerprint, refreshed_at)"""
+    with self._lock:
+      rows = self._conn.execute(
+        'SELECT campaign, fingerprint, refreshed_at FROM campaign_summary WHERE host = ? AND tenant = ?',
+        (host, tenant_id(secret_key))
+      ).fetchall()
+    return {campaign: (fp, refreshed_at) for campaign, fp, refreshed_at in rows}
+
+  def frame(self, host, secret_key):
+    with self._lock:
+      df = pd.read_sql_query(
+        f"SELECT campaign, {', '.join(SUMMARY_COLUMNS)} FROM campaign_summary WHERE host = ? AND tenant = ?",
+        self._conn,
+        params=(host, tenant_id(secret_key))
+      )
+    df['last_scan'] = pd.to_datetime(df['last_scan'], utc=True)
+    return df
+
+
+class SummaryRefresher:
+  """
+  Builds missing and outdated campaign summaries in the background, one
+  job per campaign at a time. A summary is outdated when the campaign
+  list reports a different fingerprint or it is older than SUMMARY_TTL.
+  Updates fold only the visits not seen yet into the campaign's stats.
+  Viewing a campaign on the dashboard rewrites its summary with the
+  visits seen by then. Scheduled refreshes only update outdated
+  summaries of tenants whose dashboard was viewed in the last
+  SUMMARY_IDLE seconds, every view queues the outdated ones again.
+  """
+
+  def __init__(self, store):
+    self.store = store
+    self._pool = ThreadPoolExecutor(
+      max_workers=SUMMARY_WORKERS, thread_name_prefix='summary', initializer=run_in_background
+    )
+    self._running = set()
+    # (host, secret key) -> time the dashboard last asked for a refresh
+    self.viewed_at = {}
+    self._lock = threading.Lock()
+
+  def _summarize(self, tenant, host, secret_key, campaign):
+    try:
+      contacts = contacts_frame(fetch_contacts(host, secret_key, campaign['name']))
+      # The dashboard's stats for the campaign, new visits are folded into them
+      stats = get_stats_registry().get(tenant, (host, campaign['name']), contacts, campaign.get('total'))
+      stats.update(fetch_visits(host, secret_key, contacts['id'].tolist()))
+      self.store.put(host, secret_key, campaign['name'], stats.summary(), fingerprint(campaign))
+    except Exception:
+      traceback.print_exc()
+    finally:
+      with self._lock:
+        self._running.discard((host, secret_key, campaign['name']))
+
+  def refresh(self, tenant, host, secret_key, campaigns, scheduled=False):
+    """Queues every campaign whose summary is missing or outdated"""
+    now = time.time()
+    if not scheduled:
+      self.viewed_at[(host, secret_key)] = now
+    viewed = self.viewed_at.get((host, secret_key), 0) > now - SUMMARY_IDLE
+    state = self.store.state(host, secret_key)
+    for campaign in campaigns:
+      stored = state.get(campaign['name'])
+      if stored and not viewed:
+        continue
+      if stored and stored[0] == fingerprint(campaign) and stored[1] > now - SUMMARY_TTL:
+        continue
+      key = (host, secret_key, campaign['name'])
+      with self._lock:
+        if key in self._running:
+          continue
+        self._running.add(key)
+      self._pool.submit(self._summarize, tenant, host, secret_key, campaign)
+
+
+@st.cache_resource
+def get_summary_store():
+  return SummaryStore()
+
+
+@st.cache_resource
+def get_summary_refresher():
+  return SummaryRefresher(get_summary_store())
@@ -0,0 +1,107 @@
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import streamlit as st
+
+from api_client import ApiClient
+from tenant_cache import get_tenant_cache
+
+
+# Requests per second sent to the CRM, shared by every session of a tenant
+CRM_RATE = 10
+CRM_WORKERS = 4
+# Seconds a fetched contact is reused for
+CONTACT_TTL = 10 * 60
+MAX_CACHED_CONTACTS = 20_000
+MAX_CACHED_CONTACT_BYTES = 64 * 1024 * 1024
+CRM_PREFIX = 'crm.'
+
+
+class RateLimiter:
+  """Token bucket, callers block until a request may go out"""
+
+  def __init__(self, rate, burst=None):
+    self.rate = rate
+    self.capacity = burst or rate
+    self._tokens = self.capacity
+    self._updated = time.monotonic()
+    self._lock = threading.Lock()
+
+  def acquire(self):
+    while True:
+      with self._lock:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return
+        wait = (1 - self._tokens) / self.rate
+      time.sleep(wait)
+
+
+class CrmClient:
+  """Authenticated, pooled access to the CRM contact API with a per-contact TTL cache"""
+
+  def __init__(self, tenant, api, user, password, rate=CRM_RATE):
+    self.tenant = tenant
+    self.api = api.rstrip('/')
+    self.client = ApiClient()
+    self.client.session.auth = (user, password)
+    self.limiter = RateLimiter(rate)
+    self._cache = get_tenant_cache('crm_contacts', CONTACT_TTL, MAX_CACHED_CONTACTS, MAX_CACHED_CONTACT_BYTES)
+
+  def _fetch(self, contact_id):
+    self.limiter.acquire()
+    response = self.client.request('GET', f'{self.api}/api/contacts/{contact_id}')
+    response.raise_for_status()
+    return response.json()['contact']['fields']['all']
+
+  def contact(self, contact_id):
+    return self.contacts([contact_id]).get(contact_id, {})
+
+  def contacts(self, contact_ids):
+    """contact id -> CRM fields, fetching the ones not cached concurrently"""
+    found = {}
+    missing = []
+    for contact_id in dict.fromkeys(contact_ids):
+      fields = self._cache.get(self.tenant, (self.api, contact_id))
+      if fields is None:
+        missing.append(contact_id)
+      else:
+        found[contact_id] = fields
+
+    def fetch(contact_id):
+      try:
+        return contact_id, self._fetch(contact_id)
+      except Exception:
+        traceback.print_exc()
+        return contact_id, None
+
+    if missing:
+      with ThreadPoolExecutor(max_workers=CRM_WORKERS) as pool:
+        for contact_id, fields in pool.map(fetch, missing):
+          if fields is not None:
+            self._cache.put(self.tenant, (self.api, contact_id), fields)
+            found[contact_id] = fields
+    return found
+
+  def enrich(self, df, id_column='id'):
+    """Joins the CRM fields of every row's contact onto df as crm.* columns"""
+    if df.empty:
+      return df
+    ids = df[id_column].astype(str).tolist()
+    fields = self.contacts(ids)
+    if not fields:
+      return df
+    crm = pd.DataFrame.from_dict(fields, orient='index').add_prefix(CRM_PREFIX).reindex(ids)
+    crm.index = df.index
+    return pd.concat([df, crm], axis=1)
+
+
+@st.cache_resource
+def get_crm_client(tenant, api, user, password):
+  return CrmClient(tenant, api, user, password)
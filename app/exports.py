@@ -0,0 +1,113 @@
+import gzip
+import io
+import uuid
+
+import streamlit as st
+
+from artifacts import get_store
+
+
+# Rows serialized at a time, so no full second copy of the frame is built
+EXPORT_CHUNK_ROWS = 50_000
+
+
+def _chunks(df, chunk_rows=EXPORT_CHUNK_ROWS):
+  for start in range(0, len(df), chunk_rows):
+    yield df.iloc[start:start + chunk_rows]
+
+
+def write_csv(fileobj, df):
+  text = io.TextIOWrapper(fileobj, encoding='utf-8', newline='', write_through=True)
+  if df.empty:
+    df.to_csv(text, index=False)
+  for i, chunk in enumerate(_chunks(df)):
+    chunk.to_csv(text, index=False, header=i == 0)
+  text.detach()
+
+
+def write_csv_gz(fileobj, df):
+  with gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=6) as gz:
+    write_csv(gz, df)
+
+
+def _arrow_chunk(chunk):
+  import pyarrow as pa
+
+  # Object columns can mix types or hold dicts, they are exported as text
+  chunk = chunk.copy(deep=False)
+  for name in chunk.columns[chunk.dtypes == object]:
+    column = chunk[name]
+    chunk[name] = column.where(column.isna(), column.astype(str)).astype('string')
+  chunk.columns = [str(name) for name in chunk.columns]
+  return pa.Table.from_pandas(chunk, preserve_index=False)
+
+
+def write_parquet(fileobj, df):
+  # pyarrow is only loaded once an Arrow based export is asked for
+  import pyarrow.parquet as pq
+
+  writer = None
+  for chunk in _chunks(df) if not df.empty else [df]:
+    table = _arrow_chunk(chunk)
+    if writer is None:
+      writer = pq.ParquetWriter(fileobj, table.schema, compression='zstd')
+    writer.write_table(table)
+  writer.close()
+
+
+def write_arrow(fileobj, df):
+  import pyarrow as pa
+
+  writer = None
+  for chunk in _chunks(df) if not df.empty else [df]:
+    table = _arrow_chunk(chunk)
+    if writer is None:
+      writer = pa.ipc.new_file(fileobj, table.schema)
+    writer.write_table(table)
+  writer.close()
+
+
+# label -> (extension, mime type, writer)
+EXPORT_FORMATS = {
+  'CSV': ('csv', 'text/csv', write_csv),
+  'CSV (gzip)': ('csv.gz', 'application/gzip', write_csv_gz),
+  'Parquet': ('parquet', 'application/vnd.apache.parquet', write_parquet),
+  'Arrow': ('arrow', 'application/vnd.apache.arrow.file', write_arrow),
+}
+
+
+def export_owner():
+  """Artifact workspace of the current session's exports"""
+  if 'export_owner' not in st.session_state:
+    st.session_state['export_owner'] = f'export-{uuid.uuid4().hex}'
+  return st.session_state['export_owner']
+
+
+def offer_export(key, file_name, version, load):
+  """
+  Format picker and download for a frame. load() is only called, and the
+  file only written, when the user asks for a format not yet prepared for
+  this version of the data.
+  """
+  label = st.selectbox("Export format", list(EXPORT_FORMATS), key=f'{key}_export_format')
+  extension, mime, writer = EXPORT_FORMATS[label]
+  store = get_store()
+  owner = export_owner()
+  name = f'{key}-{version}.{extension}'
+  path = store.path(owner, name)
+  if path is None:
+    slot = st.empty()
+    if not slot.button(f"Prepare {label} export", key=f'{key}_export_prepare'):
+      return None
+    slot.empty()
+    with st.spinner("Preparing the export"), store.create(owner, name) as fileobj:
+      writer(fileobj, load())
+    path = store.path(owner, name)
+  with open(path, 'rb') as file:
+    return st.download_button(
+      label=f"Download {label} file",
+      data=file,
+      file_name=f"{file_name}.{extension}",
+      mime=mime,
+      key=f'{key}_export_download'
+    )
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+
+# Heavy jobs running at once for the whole container
+JOB_WORKERS = int(os.environ.get('BULK_JOB_WORKERS', 2))
+# Finished jobs are forgotten after this many seconds
+JOB_TTL = 6 * 60 * 60
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Job:
+  def __init__(self, name):
+    self.id = uuid.uuid4().hex
+    self.name = name
+    self.status = QUEUED
+    self.done = 0
+    self.total = 0
+    self.message = 'Waiting for a free worker'
+    self.result = None
+    self.error = None
+    self.created = time.time()
+    self.finished = None
+
+  @property
+  def active(self):
+    return self.status in (QUEUED, RUNNING)
+
+  @property
+  def fraction(self):
+    return self.done / self.total if self.total else 0.0
+
+  def report(self, done, total, message=None):
+    """Called from inside the job to publish progress"""
+    self.done = done
+    self.total = total
+    if message:
+      self.message = message
+
+
+class JobRunner:
+  """Worker pool shared by all sessions, jobs outlive the script run that submitted them"""
+
+  def __init__(self, workers=JOB_WORKERS):
+    self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+    self._jobs = {}
+    self._lock = threading.Lock()
+
+  def submit(self, name, fn, *args, **kwargs):
+    """Queues fn(job, *args, **kwargs) and returns the job id"""
+    job = Job(name)
+    with self._lock:
+      self._prune()
+      self._jobs[job.id] = job
+    self._pool.submit(self._run, job, fn, args, kwargs)
+    return job.id
+
+  def get(self, job_id):
+    with self._lock:
+      self._prune()
+      return self._jobs.get(job_id)
+
+  def _run(self, job, fn, args, kwargs):
+    job.status = RUNNING
+    job.message = 'Started'
+    try:
+      job.result = fn(job, *args, **kwargs)
+      job.status = DONE
+      job.message = 'Finished'
+    except Exception as e:
+      traceback.print_exc()
+      job.error = str(e)
+      job.status = FAILED
+      job.message = 'Failed'
+    finally:
+      job.finished = time.time()
+
+  def _prune(self):
+    cutoff = time.time() - JOB_TTL
+    for job_id in [k for k, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+      del self._jobs[job_id]
+
+
+@st.cache_resource
+def get_runner():
+  return JobRunner()
@@ -0,0 +1,136 @@
+import codecs
+import json
+
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\n\r'
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+  """Incrementally decoded text over an iterable of byte chunks"""
+
+  def __init__(self, chunks):
+    self._chunks = iter(chunks)
+    self._utf8 = codecs.getincrementaldecoder('utf-8')()
+    self.buf = ''
+    self.pos = 0
+    self.eof = False
+
+  def more(self):
+    # Everything before pos is parsed, only the tail is kept
+    self.buf = self.buf[self.pos:]
+    self.pos = 0
+    for chunk in self._chunks:
+      text = self._utf8.decode(chunk)
+      if text:
+        self.buf += text
+        return True
+    self.buf += self._utf8.decode(b'', final=True)
+    self.eof = True
+    return False
+
+  def peek(self):
+    """Next non-whitespace character, '' at the end of the input"""
+    while True:
+      while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+        self.pos += 1
+      if self.pos < len(self.buf):
+        return self.buf[self.pos]
+      if not self.more():
+        return ''
+
+  def take(self, expected):
+    char = self.peek()
+    if char not in expected:
+      raise ValueError(f'Expected one of {expected!r} in JSON body, got {char!r}')
+    self.pos += 1
+    return char
+
+  def value(self):
+    self.peek()
+    while True:
+      try:
+        value, end = _decoder.raw_decode(self.buf, self.pos)
+        # A value running up to the end of the buffer may continue in the next chunk
+        if end < len(self.buf) or self.eof:
+          self.pos = end
+          return value
+      except json.JSONDecodeError:
+        if self.eof:
+          raise
+      self.more()
+
+
+def _array(reader):
+  reader.take('[')
+  if reader.peek() == ']':
+    reader.pos += 1
+    return
+  while True:
+    yield reader.value()
+    if reader.take(',]') == ']':
+      return
+
+
+def iter_records(chunks, key='records', meta=None):
+  """
+  Yields the elements of a JSON body's records array while it downloads.
+
+  The body is either the array itself or an object holding it under key.
+  Other top-level fields of the object are stored in meta if given.
+  """
+  reader = _Reader(chunks)
+  if reader.peek() == '[':
+    yield from _array(reader)
+    return
+  reader.take('{')
+  if reader.peek() == '}':
+    return
+  while True:
+    name = reader.value()
+    reader.take(':')
+    if name == key and reader.peek() == '[':
+      yield from _array(reader)
+    else:
+      value = reader.value()
+      if meta is not None:
+        meta[name] = value
+    if reader.take(',}') == '}':
+      return
+
+
+def _flatten(record, prefix=''):
+  flat = {}
+  for name, value in record.items():
+    if isinstance(value, dict):
+      flat.update(_flatten(value, f'{prefix}{name}.'))
+    else:
+      flat[f'{prefix}{name}'] = value
+  return flat
+
+
+def records_frame(records, flatten=False):
+  """
+  Frame built column by column from an iterable of dicts, so parsed records
+  are never held as a list. flatten joins nested keys with dots like
+  pd.json_normalize.
+  """
+  import pandas as pd
+
+  columns = {}
+  rows = 0
+  for record in records:
+    if flatten:
+      record = _flatten(record)
+    for name, value in record.items():
+      column = columns.get(name)
+      if column is None:
+        column = columns[name] = [None] * rows
+      column.append(value)
+    rows += 1
+    if len(record) != len(columns):
+      for column in columns.values():
+        if len(column) < rows:
+          column.append(None)
+  return pd.DataFrame(columns, index=pd.RangeIndex(rows))
@@ -1,26 +1,23 @@
 import streamlit as st
-import requests
 
+from api_client import ApiError, get_client
+from campaign_catalog import created_record, get_campaign_catalog
 from utils import display_sidebar
 
 
 def create_user_campaign(host, payload):
-  url = f'https://{host}' if 'https://' not in host else host
-  response = requests.post(f'{url}/campaigns', data=payload)
+  response = get_client().post(host, 'campaigns', data=payload)
   if response.status_code == 201:
+    get_campaign_catalog().add(host, payload.get('secret_key'), created_record(payload, response))
     return st.success(f"A campaign for {payload.get('name')} was created successfully")
   elif response.status_code == 409:
+    # The backend knows a campaign the catalog doesn't
+    get_campaign_catalog().invalidate(host, payload.get('secret_key'))
     return st.error(f"A campaign under {payload.get('name')} already exists for this user")
   else:
     st.error(response.text)
 
 
-def fetch_existing_user_campaigns(host, params):
-  url = f'https://{host}' if 'https://' not in host else host
-  response = requests.get(f'{url}/campaigns', params=params)
-  return response.json()
-
-
 def main():
   secrets = st.secrets
   state = st.session_state
@@ -30,22 +27,24 @@ def main():
   st.set_page_config(page_title="Create a campaign", layout="wide")
   display_sidebar()
   st.title("Create a campaign")
-  existing_campaigns = fetch_existing_user_campaigns(host, {'secret_key': secret_key})
+  try:
+    existing_campaigns = get_campaign_catalog().get(host, secret_key)
+  except ApiError as e:
+    st.error(str(e))
+    st.stop()
   if existing_campaigns:
-    if not existing_campaigns.get("message"):
-      st.write(f"You currently have {existing_campaigns.get('count')} campaigns")
+    st.write(f"You currently have {existing_campaigns.get('count')} campaigns")
     campaigns = existing_campaigns.get('records')
-    if not existing_campaigns.get("message"):
-      with st.expander("Click here to view existing campaigns"):
-        st.dataframe(
-          data=campaigns,
-          column_order=("name", "destination_url", "total", "timestamp"),
-          column_config={
-            'customer_id': None,
-            'total': 'contacts'
-          }
-        )
-    if existing_campaigns and existing_campaigns.get('count') == 0:
+    with st.expander("Click here to view existing campaigns"):
+      st.dataframe(
+        data=campaigns,
+        column_order=("name", "destination_url", "total", "timestamp"),
+        column_config={
+          'customer_id': None,
+          'total': 'contacts'
+        }
+      )
+    if existing_campaigns.get('count') == 0:
       st.info("You are yet to create any campaigns")
     else:
       name = st.text_input(
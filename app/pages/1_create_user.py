@@ -1,14 +1,13 @@
-import requests
 import json
 
 import streamlit as st
+from api_client import get_client
 from utils import display_sidebar
 
 
 # Collect user email and signup to the application
 def user_signup(endpoint: str, email: str) -> dict:
-  url = f'https://{endpoint}' if 'https://' not in endpoint else endpoint
-  response = requests.post(f'{url}/users', json={'email': email})
+  response = get_client().post(endpoint, 'users', json={'email': email})
   if response.ok:
     return response.json()
   else:
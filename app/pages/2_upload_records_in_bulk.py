@@ -1,52 +1,169 @@
 import streamlit as st
-import requests
-import pandas as pd
-import segno
-import shutil
-import tempfile
-import zipfile
 from datetime import datetime, timezone
-from os import makedirs
-from io import StringIO
-import csv
-import json
 
+from api_client import ApiError
+from artifacts import get_store
+from campaign_catalog import get_campaign_catalog
+from jobs import FAILED, get_runner
+from qr_cache import get_qr_cache
+from session_data import get_session_data
 from utils import display_sidebar
 
+BULK_EXPORT_NAME = 'bulk_upload_results_{}.zip'
+EXPORT_FORMATS = {
+  "QR code images": 'png',
+  "Print sheets (PDF)": 'pdf',
+  "Print sheets (SVG)": 'svg',
+}
+
 def get_current_time_for_filenames():
   return datetime.now(timezone.utc).strftime("%Y_%m_%d_%H_%M_%S_%f")
 
-def fetch_existing_user_campaigns(host, secret_key):
-  if not host:
+# pandas, numpy and segno are imported by the functions that use them, so
+# the page paints without waiting for them
+def process_bulk_upload(job, host, secret_key, upload_bytes, report, payload):
+  from bulk_upload import upload_in_chunks
+  from preflight import clean_csv
+  from upload_index import get_result_index, upload_key
+
+  def on_progress(done, total):
+    job.report(done, total, f"Uploaded {done} of {total} chunks")
+
+  # The checked rows are only written out here, the page just showed the report
+  job.report(0, 1, "Preparing the valid rows")
+  csv_bytes = clean_csv(upload_bytes, report)
+
+  # The same file for the same campaign was processed before, reuse it
+  key = upload_key(host, csv_bytes, payload)
+  df = get_result_index().get(key)
+  if df is None:
+    df, errors = upload_in_chunks(host, csv_bytes, payload, on_progress=on_progress)
+    if errors:
+      raise RuntimeError(
+        " ".join(errors) + " Uploaded chunks are kept, uploading the same file again resumes from here"
+      )
+    get_result_index().put(key, df)
+    # The campaign's contact total changed
+    get_campaign_catalog().invalidate(host, secret_key)
+  else:
+    job.report(1, 1, "Reusing the results of an earlier upload of this file")
+  # The frame goes to the first session that shows it, the key reloads it for others
+  return {'contacts': df, 'result_key': key}
+
+def export_name(export_format):
+  return BULK_EXPORT_NAME.format(export_format)
+
+# Runs as its own job once the user asks for the download
+def build_export(job, owner, df, export_format='png'):
+  from qr_export import export_bulk_results
+  from qr_sheets import export_print_sheets
+
+  job.report(0, 1, "Generating QR codes")
+  with get_store().create(owner, export_name(export_format)) as combined_zip_file:
+    if export_format == 'png':
+      export_bulk_results(combined_zip_file, df, cache=get_qr_cache())
+    else:
+      export_print_sheets(combined_zip_file, df, export_format)
+
+def offer_download(owner, campaign_name, df, export_format):
+  zip_path = get_store().path(owner, export_name(export_format))
+  if zip_path is None:
+    export_job = get_runner().get(st.session_state.get('export_job')) if st.session_state.get('export_job') else None
+    if export_job is not None and export_job.active:
+      return show_job_progress(export_job.id)
+    if export_job is not None and export_job.status == FAILED:
+      st.error(export_job.error)
+    if st.button(label="Prepare CSV and QR Codes"):
+      st.session_state['export_job'] = get_runner().submit(
+        f"Export for {campaign_name}", build_export, owner, df, export_format
+      )
+      st.rerun()
     return None
-  url = f'https://{host}' if 'https://' not in host else host
-  params = {'secret_key': secret_key}
-  response = requests.get(f'{url}/campaigns', params=params)
-  return response.json()
+  file_ts = get_current_time_for_filenames()
+  with open(zip_path, 'rb') as file:
+    st.download_button(
+      label="Download CSV and QR Codes",
+      data=file,
+      file_name=f"campaign_{campaign_name}_bulk_upload_results_{file_ts}.zip",
+      mime="application/zip"
+    )
+
+def check_upload(job, csv_bytes):
+  from preflight import preflight
+
+  return preflight(csv_bytes, on_progress=job.report)
 
-def send_to_api(host, csv_data, payload):
-  if not host:
+# The check runs as a job, so a large file doesn't freeze the page. None until it's done
+def run_preflight(uploaded_file):
+  data = get_session_data()
+  if st.session_state.get('preflight_id') != uploaded_file.file_id:
+    data.pop('preflight')
+    st.session_state['preflight_job'] = get_runner().submit(
+      f"Checking {uploaded_file.name}", check_upload, uploaded_file.getvalue()
+    )
+    st.session_state['preflight_id'] = uploaded_file.file_id
+  report = data.get('preflight')
+  if report is not None:
+    return report
+  job = get_runner().get(st.session_state.get('preflight_job'))
+  if job is not None and job.active:
+    show_job_progress(job.id)
     return None
-  url = f'https://{host}' if 'https://' not in host else host
-  response = requests.post(f'{url}/bulk', data=payload, files={'file': csv_data})
-  if response.status_code == 200:
-    return response.json()
-  else:
-    st.error(response.text)
+  if job is not None and job.status == FAILED:
+    st.error(f"The CSV file could not be checked: {job.error}")
     return None
+  if job is None or job.result is None:
+    # The report is gone, pruned with its job or dropped from the session, check the file again
+    st.session_state['preflight_id'] = None
+    st.rerun()
+  # The report moves into the session's budgeted data
+  data['preflight'], job.result = job.result, None
+  return data['preflight']
 
-def generate_qr_codes(dataframe):
-  qr_path = tempfile.mktemp()
-  makedirs(qr_path)
-  for ind, rec in enumerate(dataframe.itertuples(index=False), 1):
-    trackableurl_index = dataframe.columns.get_loc('o.rp.trackableurl')
-    qrcode_img_index = dataframe.columns.get_loc('o.rp.qrcode_img')
-    if rec[trackableurl_index] == 'Error':
-      continue
-    else:
-      out_path = "{}/{}".format(qr_path, rec[qrcode_img_index])
-      segno.make_qr(rec[trackableurl_index]).save(out_path, scale=10, border=1)
-  shutil.make_archive("qrcodes", "zip", qr_path)
+def show_preflight(report):
+  if report.missing_columns:
+    return st.error(f"The CSV file is missing these required columns: {', '.join(report.missing_columns)}")
+  if not report.clean_rows:
+    return st.error("The CSV file has no valid rows to upload")
+  if report.has_issues:
+    problems = ', '.join(f"{count} {problem}" for problem, count in report.counts.items() if count)
+    st.warning(
+      f"{report.total_rows - report.clean_rows} of {report.total_rows} rows will be skipped ({problems})"
+    )
+    with st.expander("Click here to view rows with problems"):
+      st.dataframe(report.issues_frame(), hide_index=True)
+
+@st.experimental_fragment(run_every=1)
+def show_job_progress(job_id):
+  job = get_runner().get(job_id)
+  if job is None or not job.active:
+    st.rerun()
+  st.progress(job.fraction, text=job.message)
+
+# Moves a finished job's frame into the session's budgeted, spillable data
+def job_contacts(job):
+  from upload_index import get_result_index
+
+  data = get_session_data()
+  if st.session_state.get('bulk_result_job') == job.id and data.get('bulk_result') is not None:
+    return data['bulk_result']
+  df = job.result.pop('contacts', None)
+  if df is None:
+    # Another session took the job's frame, the processed rows are kept on disk
+    df = get_result_index().get(job.result['result_key'])
+  data['bulk_result'] = df
+  st.session_state['bulk_result_job'] = job.id
+  return df
+
+def show_job_result(job, campaign_name, export_format):
+  if job.status == FAILED:
+    return st.error(job.error)
+  df = job_contacts(job)
+  if df is None:
+    return st.error("The results of this upload are no longer available, upload the file again")
+  st.success("Data fetched from API successfully!")
+  st.dataframe(df, hide_index=True)
+  offer_download(job.id, campaign_name, df, export_format)
 
 def main():
   secrets = st.secrets
@@ -54,17 +171,23 @@ def main():
   host = secrets[state.group]["HOST"]
   secret_key = secrets[state.group]["SECRET_KEY"]
 
-  if 'trackable_urls' not in st.session_state:
-    st.session_state['trackable_urls'] = None
   if 'selected_campaign' not in st.session_state:
     st.session_state['selected_campaign'] = None
+  if 'bulk_upload_id' not in st.session_state:
+    st.session_state['bulk_upload_id'] = None
+  if 'bulk_job' not in st.session_state:
+    # A job id in the URL picks up a job submitted from an earlier session
+    st.session_state['bulk_job'] = st.query_params.get('job')
 
   st.set_page_config(page_title="Bulk data uploader", layout="wide")
   display_sidebar()
   st.title("CSV Uploader to generate short urls and QR codes in bulk")
 
   if secret_key:
-    available_campaigns = fetch_existing_user_campaigns(host, secret_key)
+    try:
+      available_campaigns = get_campaign_catalog().get(host, secret_key)
+    except ApiError as e:
+      return st.error(str(e))
     if not available_campaigns.get('message'):
       st.write(f"You currently have {available_campaigns.get('count')} campaigns")
       with st.expander("Click here to view existing campaigns"):
@@ -92,52 +215,47 @@ def main():
             help="Upload data for creating short URLs",
             type=["csv"]
           )
-          if uploaded_file is not None:
+          export_format = st.radio(
+            label="Export format",
+            options=list(EXPORT_FORMATS.keys()),
+            help="Print sheets place every QR code next to the contact's name and address, ready for the print vendor",
+            horizontal=True
+          )
+          if uploaded_file is not None and st.session_state['bulk_upload_id'] != uploaded_file.file_id:
             st.success("CSV uploaded successfully!")
+            report = run_preflight(uploaded_file)
+            if report is not None:
+              show_preflight(report)
+            if report is not None and report.ok and report.clean_rows:
+              if not report.has_issues or st.button(label=f"Upload the {report.clean_rows} valid rows"):
+                data = {
+                  'customer_id': st.session_state.selected_campaign['customer_id'],
+                  'campaign': st.session_state.selected_campaign['name'],
+                  'destination_url': st.session_state.selected_campaign['destination_url'],
+                }
+                job_id = get_runner().submit(
+                  f"Bulk upload for {data['campaign']}",
+                  process_bulk_upload,
+                  host,
+                  secret_key,
+                  uploaded_file.getvalue(),
+                  report,
+                  data
+                )
+                st.session_state['bulk_job'] = job_id
+                st.session_state['bulk_upload_id'] = uploaded_file.file_id
+                get_session_data().pop('preflight')
+                st.query_params['job'] = job_id
 
-            if st.session_state['trackable_urls'] is None:
-              st.subheader("Response from API")
-              data = {
-                'customer_id': st.session_state.selected_campaign['customer_id'],
-                'campaign': st.session_state.selected_campaign['name'],
-                'destination_url': st.session_state.selected_campaign['destination_url'],
-              }
-              csv_body = send_to_api(host, uploaded_file, data)
-              if csv_body:
-                st.success("Data fetched from API successfully!")
-                df = pd.DataFrame(csv_body)
-                st.dataframe(df, hide_index=True)
-                st.session_state['trackable_urls'] = df['o.rp.trackableurl'].tolist()
-
-                qr_zip_file = tempfile.mktemp(suffix='.zip')
-                generate_qr_codes(df)
-                shutil.move("qrcodes.zip", qr_zip_file)
-
-                with tempfile.NamedTemporaryFile(delete=False) as combined_zip_file:
-                  with zipfile.ZipFile(combined_zip_file, 'w') as zipf:
-                    zipf.writestr(
-                      'processed_contacts.csv',
-                      df.to_csv(index=False)
-                    )
-                    zipf.write(qr_zip_file, arcname='qr_codes.zip')
-
-                file_ts = get_current_time_for_filenames()
-                with open(combined_zip_file.name, 'rb') as file:
-                  st.download_button(
-                    label="Download CSV and QR Codes",
-                    data=file,
-                    file_name=f"campaign_{st.session_state.selected_campaign['name']}_bulk_upload_results_{file_ts}.zip",
-                    mime="application/zip"
-                  )
-
+          job = get_runner().get(st.session_state['bulk_job']) if st.session_state['bulk_job'] else None
+          if job is not None:
+            st.subheader("Response from API")
+            if job.active:
+              st.caption(f"Job {job.id} is processing, you can keep working and come back to this page")
+              show_job_progress(job.id)
             else:
-              csv_data = pd.DataFrame(
-                {'trackableurl': st.session_state['trackable_urls']},
-                index=range(len(st.session_state['trackable_urls']))).to_csv(index=False)
-              generate_qr_codes(
-                pd.DataFrame({'trackableurl': st.session_state['trackable_urls']})
-              )
-          else:
+              show_job_result(job, st.session_state.selected_campaign['name'], EXPORT_FORMATS[export_format])
+          elif uploaded_file is None:
             st.warning("Please upload a CSV file")
         else:
           st.error("Selected campaign is missing required attributes")
@@ -1,26 +1,20 @@
-import pandas as pd
-import requests
 import streamlit as st
 from datetime import datetime, timezone
+from api_client import ApiError, get_client
+from exports import offer_export
+from session_data import get_session_data
 from utils import display_sidebar
-from st_aggrid import GridOptionsBuilder, AgGrid, ColumnsAutoSizeMode
-
-
-# Function to fetch data from API endpoint with caching
-@st.cache_data
-def fetch_data(url, params):
-  domain = f'https://{url}' if 'https://' not in url else url
-  response = requests.get(f"{domain}/records", params=params)
-  return response.json()
 
 
 def fetch_short_url_stats(url, params):
-  domain = f'https://{url}' if 'https://' not in url else url
-  response = requests.get(f"{domain}/logs", params=params)
-  return response.json()
+  return get_client().get_json(url, 'logs', params=params)
 
 
+# pandas and st_aggrid are imported once there are records to show, so the
+# key input paints without waiting for them
 def generate_aggrid(df):
+  from st_aggrid import GridOptionsBuilder, AgGrid, ColumnsAutoSizeMode
+
   gb = GridOptionsBuilder.from_dataframe(df)
   gb.configure_selection(selection_mode="single")
   gb.configure_grid_options(domLayout='wide')
@@ -34,34 +28,64 @@ def generate_aggrid(df):
     fit_columns_on_grid_load=True,
     columns_auto_size_mode=ColumnsAutoSizeMode.FIT_CONTENTS,
   )
-  if 'selected_rows' in st.session_state:
-    st.session_state.selected_rows = grid_response['selected_rows']
+  get_session_data()['selected_rows'] = grid_response['selected_rows']
   return grid_response
 
 
+# Summary of the visits to one short url
+def display_visit_stats(records):
+  from analytics import scanner_column, visits_frame, visits_per_day, visits_per_hour
+
+  visits = visits_frame(records)
+  column = scanner_column(visits)
+  m1, m2, m3 = st.columns(3)
+  m1.metric("Visits", len(visits))
+  m2.metric("Unique scanners", visits[column].nunique() if column else "-")
+  m3.metric("Last visit", str(visits["timestamp"].max().floor("min")) if visits["timestamp"].notna().any() else "-")
+  c1, c2 = st.columns(2)
+  with c1:
+    st.caption("Visits per day")
+    st.bar_chart(visits_per_day(visits).rename("visits"))
+  with c2:
+    st.caption("Visits per hour of day (UTC)")
+    st.bar_chart(visits_per_hour(visits).rename("visits"))
+  return st.dataframe(records)
+
+
 # Function to get current time for filenames
 def get_current_time_for_filenames():
   return datetime.now(timezone.utc).strftime("%Y_%m_%d_%H_%M_%S_%f")
 
 
 # Function to display records
-def display_records(data):
-  if data:
-    count = data.get('count', 0)
-    if count != 0:
-      st.write(f'Number of short urls created by you, as of now: {count}')
-    df = pd.DataFrame(data['records']) if data.get('records', None) else None
-    if df is not None:
-      csv = df.to_csv(index=False)
-      file_ts = get_current_time_for_filenames()
-      st.download_button(
-          label="Download CSV file",
-          data=csv, file_name=f"short_urls_{file_ts}.csv", mime="text/csv")
-      return df
-    else:
-      st.error("You are yet to create any short url records")
+def display_records(source):
+  from schema import memory_note
+
+  count = source.count()
+  if count != 0:
+    st.write(f'Number of short urls created by you, as of now: {count}')
+    note = memory_note(source.frame())
+    if note:
+      st.caption(note)
+    offer_export("short_urls", f"short_urls_{get_current_time_for_filenames()}", source.version(), source.frame)
+    return source
   else:
-    return st.warning("There is currently no data to display")
+    st.error("You are yet to create any short url records")
+
+
+# Page, sort and filter controls, only the current page goes to the grid
+def display_page(source):
+  col_search, col_sort, col_order, col_page = st.columns([3, 2, 1, 1])
+  with col_search:
+    search = st.text_input(label="Filter", placeholder="Search in any column")
+  with col_sort:
+    sort = st.selectbox(label="Sort by", options=[None] + source.columns)
+  with col_order:
+    descending = st.toggle(label="Descending")
+  page_count = source.page_count(sort, descending, search)
+  with col_page:
+    page_number = st.number_input(label=f"Page of {page_count}", min_value=1, max_value=page_count, value=1)
+  return source.page(page_number - 1, sort, descending, search)
 
 
 def main():
@@ -71,8 +95,6 @@ def main():
   # Initialize session state
   if 'secret_key' not in st.session_state:
     st.session_state.secret_key = None
-  if 'selected_rows' not in st.session_state:
-    st.session_state.selected_rows = None
 
   st.set_page_config(
       page_title="List of short URLs created by a user",
@@ -80,6 +102,8 @@ def main():
   )
   display_sidebar()
   st.title("Short URL records created by a user")
+  # Large values live in the session's spillable data, not in session_state
+  data = get_session_data()
 
   secret_key = st.text_input(
     label='Your assigned secret key',
@@ -96,42 +120,35 @@ def main():
     if not secret_key:
       st.error("Value for secret key cannot be empty")
     else:
-      st.subheader("Results")
-      try:
-        request = fetch_data(
-            host,
-            {'secret_key': secret_key}
-        )
-        df = display_records(request)
-        if df is not None:
-          # Only update the DataFrame if the data has changed
-          if 'df' not in st.session_state or not df.equals(st.session_state.df):
-            st.session_state.df = df
-
-      except (ConnectionError, Exception) as e:
-        st.error(f"{str(e)}")
-
-  # st.code(st.session_state)
+      from records_source import RecordsSource
+      data['records_source'] = RecordsSource(host, secret_key)
 
   # Render the AgGrid outside of the if submit_btn: block
-  if 'df' in st.session_state:
-    generate_aggrid(st.session_state.df)
-  if st.session_state.selected_rows is None:
+  source = data.get('records_source')
+  if source is not None:
+    st.subheader("Results")
+    try:
+      if display_records(source) is not None:
+        generate_aggrid(display_page(source))
+    except (ConnectionError, Exception) as e:
+      data.pop('records_source')
+      st.error(f"{str(e)}")
+  selected_rows = data.get('selected_rows')
+  if not selected_rows:
     st.warning("No short url record is selected yet.")
   else:
-    selected_row = st.session_state.selected_rows
-    if selected_row is None:
-      return st.warning("Please select any one row to view statistics")
-    else:
-      try:
-        params = {'secret_key': secret_key, 'path': selected_row["short_url"]}
-        response = fetch_short_url_stats(host, params)
-        if response['count'] == 0:
-          return st.error('The selected short url does not have any visits yet')
-        else:
-          return st.dataframe(response['records'])
-      except KeyError:
-        print(selected_row)
+    selected_row = selected_rows[0]
+    try:
+      params = {'secret_key': secret_key, 'path': selected_row["short_url"]}
+      response = fetch_short_url_stats(host, params)
+      if response['count'] == 0:
+        return st.error('The selected short url does not have any visits yet')
+      else:
+        return display_visit_stats(response['records'])
+    except ApiError as e:
+      return st.error(str(e))
+    except KeyError:
+      print(selected_row)
 
 
 if __name__ == '__main__':
@@ -1,12 +1,9 @@
-import json
-import pandas as pd
-import numpy as np
-import requests
 import streamlit as st
+from requests.exceptions import RequestException
 
-from pandas import json_normalize
-from pprint import pprint,pformat
-from st_aggrid import GridOptionsBuilder, AgGrid, GridUpdateMode, DataReturnMode, ColumnsAutoSizeMode
+from api_client import ApiError
+from campaign_catalog import get_campaign_catalog
+from tenant_cache import invalidate_tenant
 from utils import display_sidebar
 
 st.set_page_config(
@@ -29,15 +26,30 @@ hide_menu_style = """
         """
 st.markdown(hide_menu_style, unsafe_allow_html=True)
 
+# The data stack is imported once the page chrome is out, so it paints first
+import pandas as pd
+from pandas import json_normalize
+from st_aggrid import GridOptionsBuilder, AgGrid, ColumnsAutoSizeMode
+from analytics import contacts_frame, get_stats_registry
+from campaign_summary import fingerprint, get_summary_refresher, get_summary_store
+from crm import CRM_PREFIX, get_crm_client
+from visit_index import get_prefetcher
+
 secrets = st.secrets
 state = st.session_state
 host = secrets[state.group]["HOST"]
 secret_key = secrets[state.group]["SECRET_KEY"]
 
-if "group" in st.session_state and state.group == st.session_state["group"]:
+# state.group is the session's own key, so the tenant last shown here is
+# remembered separately to notice a switch
+if "group" in st.session_state and state.group == state.get("cached_group"):
   pass
 else:
-  st.cache_data.clear()
+  # Switching tenants drops only the incoming tenant's cached results,
+  # a session's first visit reuses whatever other sessions cached
+  if state.get("cached_group") is not None:
+    invalidate_tenant(state.group)
+  state["cached_group"] = state.group
   if state.group in st.secrets:
     st.session_state["group"] = state.group
   else:
@@ -51,54 +63,68 @@ SECRET_KEY = secrets[state.group]["SECRET_KEY"]
 ENDPOINT = secrets[state.group]["HOST"]
 
 
-def format_prepped_request(prepped, encoding=None):
-    # prepped has .method, .path_url, .headers and .body attribute to view the request
-    encoding = encoding or requests.utils.get_encoding_from_headers(prepped.headers)
-    # body = prepped.body.decode(encoding) if encoding else '<binary data>'
-    body = ''
-    headers = '\n'.join(['{}: {}'.format(*hv) for hv in prepped.headers.items()])
-    return f'''{prepped.method} {prepped.path_url} HTTP/1.1
-    {headers}
-
-    {body}'''
-
-
-def get_response(endpoint):
-  endpoint = f'{API}/api/{endpoint}'
-  session = requests.Session()
-  request = requests.Request('GET', endpoint, auth=(USER, PASS))
-  prepped = session.prepare_request(request)
+# One authenticated, rate-limited CRM session per tenant, shared by all sessions
+def get_crm():
+    return get_crm_client(state.group, API, USER, PASS)
 
-  print("Sending request:")
-  print(format_prepped_request(prepped, 'utf8'))
-  print()
-  response = session.send(prepped, verify=True)
-  return response
 
-
-@st.cache_data()
-def get_contact_activity(contact_id):
-    response = requests.get(f"https://{ENDPOINT}/related", params={'secret_key': SECRET_KEY, 'path': contact_id})
-    body = response.json()
-    return json_normalize(body['records'])
-
-
-@st.cache_data()
 def get_contact(contact_id):
-    data = json.loads(get_response(f"contacts/{contact_id}").text)
-    return json_normalize(data["contact"]["fields"]["all"])
+    return json_normalize(get_crm().contact(str(contact_id)))
 
 
-@st.cache_data()
+# Selecting a campaign starts fetching its contacts and all their visits at once
 def get_contacts(campaign_name):
-    response = requests.get(f"https://{ENDPOINT}/records", params={'secret_key': SECRET_KEY, 'campaign': campaign_name})
-    return json_normalize(response.json())
+    return get_prefetcher().prefetch(state.group, ENDPOINT, SECRET_KEY, campaign_name).contacts()
+
+
+# Polls the campaign's prefetch, the page reruns with its statistics once the visits are in
+@st.experimental_fragment(run_every=1)
+def wait_for_visits(prefetch):
+    if prefetch.ready():
+        if prefetch.error() is None:
+            st.rerun()
+        st.error(f"Could not load the visits of the campaign: {prefetch.error()}")
+        return
+    st.subheader("Campaign Statistics")
+    st.caption("Fetching the visits of every contact, the statistics show once they are in")
+
+
+def show_campaign_stats(campaign_name, prefetch, contacts_df, total_contacts=None):
+    contacts = contacts_frame(contacts_df)
+    stats = get_stats_registry().get(state.group, (ENDPOINT, campaign_name), contacts, total_contacts)
+    stats.update(prefetch.visits())
+    summary = stats.summary()
+    # The dashboard just computed this campaign, keep its grid row current too
+    campaign = df0_.loc[df0_["name"] == campaign_name].iloc[0].to_dict()
+    get_summary_store().put(ENDPOINT, SECRET_KEY, campaign_name, summary, fingerprint(campaign))
+
+    st.subheader("Campaign Statistics")
+    m1, m2, m3, m4, m5 = st.columns(5)
+    m1.metric("Contacts", summary["contacts"])
+    m2.metric("Responded", summary["responded"], f"{summary['response rate']:.1%}", delta_color="off")
+    m3.metric("Visits", summary["visits"])
+    m4.metric("Unique scanners", summary["unique scanners"])
+    delay = summary["median time to first scan"]
+    m5.metric("Median time to first scan", str(delay.floor("min")) if delay is not None else "-")
+    if stats.visits:
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            st.caption("Visits per day")
+            st.bar_chart(stats.by_day.rename("visits"))
+        with c2:
+            st.caption("Visits per hour of day (UTC)")
+            st.bar_chart(stats.by_hour.rename("visits"))
+        with c3:
+            st.caption("Response by ZIP")
+            st.dataframe(stats.zip_breakdown(), use_container_width=True)
 
 
 def get_campaigns(search=None):
-    response = requests.get(f"https://{ENDPOINT}/campaigns", params={'secret_key': SECRET_KEY})
-    body = response.json()
-    return body['records']
+    return get_campaign_catalog().records(ENDPOINT, SECRET_KEY)
+
+
+# CRM fields added to the contacts grid when they come back from the CRM
+CRM_GRID_FIELDS = ("email", "phone")
 
 
 def df_cols(df):
@@ -121,13 +147,19 @@ def make_ag(df1):
 
 
 st.header("Campaigns")
-df0_ = pd.DataFrame(get_campaigns(""))
+try:
+    campaign_records = get_campaigns("")
+except ApiError as e:
+    st.error(str(e))
+    st.stop()
+get_summary_refresher().refresh(state.group, ENDPOINT, SECRET_KEY, campaign_records)
+df0_ = pd.DataFrame(campaign_records)
 df0_cols = df_cols(df0_)
 df0 = df0_[[
             "name", "destination_url", "timestamp"
           ]].rename(columns={
             "name": "campaign"
-          })
+          }).merge(get_summary_store().frame(ENDPOINT, SECRET_KEY), on="campaign", how="left")
 col1, col2 = st.columns(2)
 with st.container():
     with col1:
@@ -143,10 +175,21 @@ with st.spinner("Displaying results..."):
                 q0 = df0[df0_["name"] == campaign_name].iloc[0].rename("").to_frame()
                 # q0[" "] = " " #hack to make last column resizable
                 st.dataframe(q0, use_container_width=True)
+        try:
+            qdf_ = pd.DataFrame(get_contacts(campaign_name))
+        except RequestException as e:
+            st.error(f"Could not load campaign {campaign_name}: {e}")
+            st.stop()
+        # The visits may still be loading, the statistics go here once the contacts are out
+        prefetch = get_prefetcher().prefetch(state.group, ENDPOINT, SECRET_KEY, campaign_name)
+        stats_slot = st.container()
         st.subheader("Responded Contacts")
+        with_crm = st.toggle("Include CRM details", key="with_crm")
         col_l, col_r = st.columns(2)
-        qdf_ = pd.DataFrame(get_contacts(campaign_name))
         if not qdf_.empty:
+            if with_crm:
+                with st.spinner("Fetching CRM details..."):
+                    qdf_ = get_crm().enrich(qdf_, "id")
             qdf_cols = df_cols(qdf_)
             qdf_disp = qdf_
             qdf = qdf_[[
@@ -163,6 +206,9 @@ with st.spinner("Displaying results..."):
                     "data_row.Owner First Name": "First Name",
                     "data_row.Owner Last Name": "Last Name",
                 })
+            crm_cols = [f"{CRM_PREFIX}{field}" for field in CRM_GRID_FIELDS if f"{CRM_PREFIX}{field}" in qdf_]
+            if crm_cols:
+                qdf = qdf.join(qdf_[crm_cols].rename(columns=lambda col: col[len(CRM_PREFIX):].title()))
             with col_l:
                 gr_resp1 = make_ag(qdf)
             sel1 = gr_resp1['selected_rows']
@@ -176,7 +222,10 @@ with st.spinner("Displaying results..."):
                         st.dataframe(q1, use_container_width=True)
                 st.subheader("Contact Visits")
                 col_a, col_b = st.columns(2)
-                cdf_ = pd.DataFrame(get_contact_activity(c_id))
+                # Answered from the campaign's prefetched path -> visits index
+                cdf_ = pd.DataFrame(prefetch.index().get(c_id)) if prefetch.ready() and prefetch.error() is None else pd.DataFrame()
+                if not prefetch.ready():
+                    st.caption("The campaign's visits are still loading")
                 if not cdf_.empty:
                     cdf_cols = df_cols(cdf_)
                     # with st.expander("Available Fields"):
@@ -194,4 +243,11 @@ with st.spinner("Displaying results..."):
                         with col_b:
                             q2 = cdf_d.iloc[int(sel2[0]["_selectedRowNodeInfo"]["nodeId"])].rename("").to_frame()
                             # q2[" "] = " " #hack to make last column resizable
-                            st.dataframe(q2, use_container_width=True)
\ No newline at end of file
+                            st.dataframe(q2, use_container_width=True)
+        if not qdf_.empty:
+            with stats_slot:
+                if prefetch.ready() and prefetch.error() is None:
+                    total = df0_.loc[df0_["name"] == campaign_name].get("total")
+                    show_campaign_stats(campaign_name, prefetch, qdf_, int(total.iloc[0]) if total is not None and pd.notna(total.iloc[0]) else None)
+                else:
+                    wait_for_visits(prefetch)
@@ -1,8 +1,7 @@
-import pandas as pd
-import requests
 import streamlit as st
 from datetime import datetime, timezone
 
+from exports import offer_export
 from utils import display_sidebar
 
 
@@ -10,32 +9,36 @@ def get_current_time_for_filenames():
   return datetime.now(timezone.utc).strftime("%Y_%m_%d_%H_%M_%S_%f")
 
 
-# Fetch the data for tabular display from the API endpoint
-def fetch_visitor_records(url):
-  domain = f'https://{url}' if 'https://' not in url else url
-  response = requests.get(f"{domain}/logs", params={'path': 'px'})
-  return response.json()
+# Bring the local log store up to date and read the visits from it
+# pandas comes in with the log store, once logs are asked for
+def fetch_visitor_records(url, sync=True):
+  from pixel_store import get_log_store
+
+  store = get_log_store()
+  new_records = store.sync(url, 'px') if sync else 0
+  return {'count': store.count(url, 'px'), 'new': new_records, 'records': store.frame(url, 'px')}
 
 
 # Define the response in a tabular fashion
 def display_records(data):
+  from schema import memory_note
+
   if data:
     # Transform the data from the API to a Dataframe
     count = data.get('count', 0)
-    st.write(f'Number of visits recorded as of now: {count}')
-    df = pd.DataFrame(data['records']) if data.get('records', None) else None
+    st.write(f'Number of visits recorded as of now: {count} ({data.get("new", 0)} new since the last refresh)')
+    df = data['records'] if not data['records'].empty else None
     # Display the DataFrame using streamlist
     # Add download button to download DataFrame as CSV
     if df is not None:
       # Display the DataFrame using Streamlit
       tabular_data = st.dataframe(data=df, use_container_width=True)
+      note = memory_note(df)
+      if note:
+        st.caption(note)
 
-      # Add download button to download DataFrame as CSV
-      csv = df.to_csv(index=False)
-      file_ts = get_current_time_for_filenames()
-      st.download_button(
-        label="Download CSV file",
-        data=csv, file_name=f"pixel_logs_{file_ts}.csv", mime="text/csv")
+      # The log store only grows, so the count identifies this data
+      offer_export("pixel_logs", f"pixel_logs_{get_current_time_for_filenames()}", count, lambda: df)
       return tabular_data
     else:
       st.error("The given short URL record was not found")
@@ -57,9 +60,13 @@ def main():
   submit_btn = st.button(label='Fetch logs')
 
   if submit_btn:
+    st.session_state['pixel_logs_fetched'] = True
+
+  # Reruns from the export widgets show the stored logs without syncing again
+  if st.session_state.get('pixel_logs_fetched'):
     st.divider()
     try:
-      request = fetch_visitor_records(host)
+      request = fetch_visitor_records(host, sync=submit_btn)
       display_records(request)
     except (ConnectionError, Exception) as e:
       st.error(f"{str(e)}")
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+import streamlit as st
+
+from api_client import get_client
+from schema import compact
+from tenant_cache import get_tenant_cache, sizeof
+
+
+LOG_DB_PATH = os.environ.get('LOG_DB_PATH', os.path.join(tempfile.gettempdir(), 'pixel_logs.sqlite3'))
+# Records up to this much older than the newest stored one are asked for
+# again, so those that reach the backend late are still picked up
+SYNC_LOOKBACK = timedelta(hours=1)
+# The whole history is read again this often, for records without a timestamp
+FULL_SYNC_INTERVAL = 24 * 60 * 60
+# Frames built from the store, per host and path, rebuilt when it grows
+FRAME_TTL = 60 * 60
+MAX_FRAMES = 16
+FRAME_MAX_BYTES = int(os.environ.get('LOG_FRAME_MAX_BYTES', 256 * 1024 * 1024))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS logs (
+  host TEXT NOT NULL,
+  path TEXT NOT NULL,
+  timestamp TEXT,
+  digest TEXT NOT NULL,
+  record TEXT NOT NULL,
+  UNIQUE (host, path, digest)
+);
+CREATE INDEX IF NOT EXISTS logs_by_time ON logs (host, path, timestamp);
+CREATE TABLE IF NOT EXISTS syncs (
+  host TEXT NOT NULL,
+  path TEXT NOT NULL,
+  full_sync_at REAL NOT NULL,
+  PRIMARY KEY (host, path)
+);
+'''
+
+
+def _since(newest):
+  """Timestamp SYNC_LOOKBACK before newest, in the same ISO format"""
+  try:
+    return (datetime.fromisoformat(newest) - SYNC_LOOKBACK).isoformat()
+  except ValueError:
+    return newest
+
+
+def _digest(record):
+  return hashlib.sha1(json.dumps(record, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class LogStore:
+  """
+  Append-only local copy of /logs per host and path.
+
+  sync() asks /logs only for records since SYNC_LOOKBACK before the
+  newest one stored. Records are stored once by digest, so the overlap,
+  or a backend that ignores since, never duplicates any. Once every
+  FULL_SYNC_INTERVAL the whole history is read, which picks up undated
+  records and any that arrived later than the lookback.
+
+  frame() is cached until a sync stores something new.
+  """
+
+  def __init__(self, db_path=LOG_DB_PATH):
+    self._lock = threading.Lock()
+    self._conn = sqlite3.connect(db_path, check_same_thread=False)
+    self._conn.execute('PRAGMA journal_mode=WAL')
+    self._conn.executescript(SCHEMA)
+    self._frames = get_tenant_cache('pixel_log_frames', FRAME_TTL, MAX_FRAMES, FRAME_MAX_BYTES)
+
+  def _sync_state(self, host, path):
+    """(newest timestamp stored, time of the last full sync)"""
+    with self._lock:
+      newest = self._conn.execute(
+        'SELECT MAX(timestamp) FROM logs WHERE host = ? AND path = ?', (host, path)
+      ).fetchone()[0]
+      row = self._conn.execute(
+        'SELECT full_sync_at FROM syncs WHERE host = ? AND path = ?', (host, path)
+      ).fetchone()
+    return newest, row[0] if row else 0.0
+
+  def sync(self, host, path, params=None):
+    """Stores the records not seen before, returns how many were new"""
+    params = dict(params or {}, path=path)
+    newest, full_sync_at = self._sync_state(host, path)
+    full = newest is None or full_sync_at < time.time() - FULL_SYNC_INTERVAL
+    if not full:
+      params['since'] = _since(newest)
+    records = (get_client().get_json(host, 'logs', params=params) or {}).get('records') or []
+    rows = [
+      (host, path, record.get('timestamp'), _digest(record), json.dumps(record))
+      for record in records
+    ]
+    with self._lock, self._conn:
+      before = self._conn.total_changes
+      self._conn.executemany('INSERT OR IGNORE INTO logs VALUES (?, ?, ?, ?, ?)', rows)
+      added = self._conn.total_changes - before
+      if full:
+        self._conn.execute('INSERT OR REPLACE INTO syncs VALUES (?, ?, ?)', (host, path, time.time()))
+      return added
+
+  def count(self, host, path):
+    with self._lock:
+      return self._conn.execute(
+        'SELECT COUNT(*) FROM logs WHERE host = ? AND path = ?', (host, path)
+      ).fetchone()[0]
+
+  def frame(self, host, path):
+    # The store only grows, so its row count tells whether the cached frame is current
+    count = self.count(host, path)
+    cached = self._frames.get(host, path)
+    if cached is not None and cached[0] == count:
+      return cached[1]
+    with self._lock:
+      rows = self._conn.execute(
+        'SELECT record FROM logs WHERE host = ? AND path = ? ORDER BY timestamp, rowid', (host, path)
+      ).fetchall()
+    df = compact(pd.DataFrame([json.loads(row[0]) for row in rows]), 'logs')
+    self._frames.put(host, path, (len(rows), df), size=sizeof(df))
+    return df
+
+
+@st.cache_resource
+def get_log_store():
+  return LogStore()
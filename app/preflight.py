@@ -0,0 +1,291 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+
+REQUIRED_COLUMNS = ('envelope_name', 'greeting_name', 'ma-addr_line1', 'ma-city', 'ma-state', 'ma-zip')
+# Problem rows kept for display, the counts cover every row
+MAX_ISSUES_SHOWN = 200
+ENCODINGS = ('utf-8-sig', 'cp1252', 'latin-1')
+# Separates the fields of a row's duplicate key, never part of a trimmed value
+KEY_SEPARATOR = '\x1f'
+# Bytes scanned at once for the line each row starts on
+SCAN_BLOCK = 16 * 1024 * 1024
+
+
+class PreflightReport:
+  def __init__(self, encoding):
+    self.encoding = encoding
+    # Header names as written in the file, and stripped
+    self.raw_columns = []
+    self.columns = []
+    self.missing_columns = []
+    self.total_rows = 0
+    self.clean_rows = 0
+    self.counts = {'missing values': 0, 'invalid zip': 0, 'duplicate': 0, 'malformed': 0}
+    self.issues = []
+    # Per parsed row, whether it goes into the clean CSV
+    self.keep = np.zeros(0, dtype=bool)
+
+  @property
+  def ok(self):
+    return not self.missing_columns
+
+  @property
+  def has_issues(self):
+    return bool(self.missing_columns) or self.clean_rows != self.total_rows
+
+  def issues_frame(self):
+    return pd.DataFrame(self.issues, columns=['row', 'problem'])
+
+
+def detect_encoding(csv_bytes, sample_size=1024 * 1024):
+  sample = csv_bytes[:sample_size]
+  for encoding in ENCODINGS:
+    try:
+      sample.decode(encoding)
+      return encoding
+    except UnicodeDecodeError:
+      # A multibyte character may be cut at the end of the sample
+      try:
+        sample[:-4].decode(encoding)
+        return encoding
+      except UnicodeDecodeError:
+        continue
+  return ENCODINGS[-1]
+
+
+def _read_options(encoding, use_threads=True):
+  # Arrow skips a UTF-8 BOM itself, other encodings are transcoded while reading
+  return pv.ReadOptions(encoding='utf8' if encoding == 'utf-8-sig' else encoding, use_threads=use_threads)
+
+
+def _parse_options(invalid):
+  # Rows with too few or too many fields are skipped by both passes and reported
+  def skip(row):
+    invalid.append(row.number)
+    return 'skip'
+  return pv.ParseOptions(newlines_in_values=True, invalid_row_handler=skip)
+
+
+def _convert_options(columns):
+  return pv.ConvertOptions(
+    column_types={name: pa.string() for name in columns},
+    include_columns=list(columns),
+    strings_can_be_null=False,
+  )
+
+
+def _header(csv_bytes, encoding):
+  try:
+    reader = pv.open_csv(io.BytesIO(csv_bytes), read_options=_read_options(encoding), parse_options=_parse_options([]))
+  except pa.ArrowInvalid:
+    # Empty file
+    return []
+  names = reader.schema.names
+  reader.close()
+  return names
+
+
+# Whitespace as the \s of the regular expressions below
+_SPACES = (9, 10, 12, 13, 32)
+
+
+def _collapse_chunk(values):
+  offsets = np.frombuffer(values.buffers()[1], dtype=np.int32)[values.offset:values.offset + len(values) + 1]
+  if not len(values) or offsets[-1] == offsets[0]:
+    return values
+  data = np.frombuffer(values.buffers()[2], dtype=np.uint8)[offsets[0]:offsets[-1]]
+  space = data == 32
+  other = np.zeros(len(data), dtype=bool)
+  for byte in _SPACES[:-1]:
+    other |= data == byte
+  # Values are trimmed, so a run never crosses into the next value
+  odd = other
+  odd[:-1] |= space[:-1] & (space[1:] | other[1:])
+  rows = np.unique(np.searchsorted(offsets, np.flatnonzero(odd) + offsets[0], side='right') - 1)
+  if not len(rows):
+    return values
+  mask = np.zeros(len(values), dtype=bool)
+  mask[rows] = True
+  fixed = pc.replace_substring_regex(values.take(pa.array(rows)), r'\s+', ' ')
+  return pc.replace_with_mask(values, pa.array(mask), fixed)
+
+
+def collapse_whitespace(values):
+  """Runs of whitespace in trimmed values made one space, the regex only runs on values that have one"""
+  return pa.chunked_array([_collapse_chunk(chunk) for chunk in values.chunks], type=values.type)
+
+
+def normalize_zip(zips):
+  """5 digit or ZIP+4 codes, leading zeros that spreadsheets drop are put back. Null when invalid"""
+  digits = pc.replace_substring_regex(zips, r'\D', '')
+  length = pc.utf8_length(digits)
+  short = pc.and_(pc.greater_equal(length, 3), pc.less_equal(length, 5))
+  plus4 = pc.equal(length, 9)
+  zip4 = pc.binary_join_element_wise(
+    pc.utf8_slice_codeunits(digits, 0, 5), pc.utf8_slice_codeunits(digits, 5), '-'
+  )
+  invalid = pa.scalar(None, pa.string())
+  return pc.if_else(short, pc.utf8_lpad(digits, 5, '0'), pc.if_else(plus4, zip4, invalid))
+
+
+def normalize(table):
+  """Required columns of table as uploaded: trimmed, single spaced, upper case state, padded zip"""
+  columns = {}
+  for name in REQUIRED_COLUMNS:
+    values = pc.utf8_trim_whitespace(table[name])
+    if name == 'ma-state':
+      values = pc.utf8_upper(values)
+    if name != 'ma-zip':
+      values = collapse_whitespace(values)
+    columns[name] = values
+  return columns
+
+
+def record_lines(csv_bytes):
+  """
+  Line of the file each row after the header starts on, header is line 1.
+  Like the parser, newlines inside quoted values don't start a row and
+  empty lines are skipped.
+  """
+  data = np.frombuffer(csv_bytes, dtype=np.uint8)
+  newlines = [np.zeros(0, dtype=np.int64)]
+  quotes = [np.zeros(0, dtype=np.int64)]
+  for start in range(0, len(data), SCAN_BLOCK):
+    block = data[start:start + SCAN_BLOCK]
+    newlines.append(np.flatnonzero(block == 10) + start)
+    quotes.append(np.flatnonzero(block == 34) + start)
+  newlines = np.concatenate(newlines)
+  quotes = np.concatenate(quotes)
+  # A newline ends a row when an even number of quotes comes before it
+  ends = np.flatnonzero(np.searchsorted(quotes, newlines) % 2 == 0)
+  starts = newlines[ends] + 1
+  lines = ends + 2
+  inside = starts < len(data)
+  starts, lines = starts[inside], lines[inside]
+  first = data[starts]
+  second = data[np.minimum(starts + 1, len(data) - 1)]
+  empty = (first == 10) | ((first == 13) & (second == 10))
+  return lines[~empty]
+
+
+def _numbered(report, invalid, lines):
+  """
+  (lines of the parsed rows, lines of the skipped ones). invalid holds
+  the parser's row numbers, which count rows rather than lines.
+  """
+  if len(lines) != report.total_rows:
+    # The scan disagrees with the parser, count one line per row
+    lines = np.arange(2, report.total_rows + 2)
+  skipped = np.asarray(sorted(invalid), dtype=np.int64) - 2
+  parsed = np.ones(len(lines), dtype=bool)
+  parsed[skipped] = False
+  return lines[parsed], lines[skipped]
+
+
+def _add_issues(report, lines, problem):
+  room = MAX_ISSUES_SHOWN - len(report.issues)
+  report.counts[problem] += len(lines)
+  if room > 0:
+    report.issues.extend((int(line), problem) for line in lines[:room])
+
+
+def preflight(csv_bytes, on_progress=None):
+  """
+  Checks an uploaded CSV and returns a PreflightReport: problem counts,
+  the first problem rows and which rows are kept. Only the required
+  columns are read. The clean CSV is written later by clean_csv().
+  on_progress(done, total, message) is called between the steps.
+  """
+  progress = on_progress or (lambda done, total, message: None)
+  progress(0, 4, "Reading the header")
+  encoding = detect_encoding(csv_bytes)
+  report = PreflightReport(encoding)
+  report.raw_columns = _header(csv_bytes, encoding)
+  report.columns = [str(name).strip() for name in report.raw_columns]
+  report.missing_columns = [name for name in REQUIRED_COLUMNS if name not in report.columns]
+  if report.missing_columns:
+    return report
+
+  progress(1, 4, "Reading the rows")
+  raw = [report.raw_columns[report.columns.index(name)] for name in REQUIRED_COLUMNS]
+  invalid = []
+  read = lambda use_threads: pv.read_csv(
+    io.BytesIO(csv_bytes),
+    read_options=_read_options(encoding, use_threads),
+    parse_options=_parse_options(invalid),
+    convert_options=_convert_options(raw),
+  )
+  table = read(True)
+  if invalid:
+    # Line numbers of skipped rows are only known to a single threaded parse
+    invalid.clear()
+    table = read(False)
+  table = table.rename_columns(list(REQUIRED_COLUMNS))
+  report.total_rows = table.num_rows + len(invalid)
+  progress(2, 4, "Numbering the rows")
+  lines, skipped = _numbered(report, invalid, record_lines(csv_bytes))
+  _add_issues(report, skipped, 'malformed')
+
+  progress(3, 4, "Checking values and duplicates")
+  columns = normalize(table)
+  missing = np.zeros(table.num_rows, dtype=bool)
+  for values in columns.values():
+    missing |= pc.equal(values, '').to_numpy(zero_copy_only=False)
+  _add_issues(report, lines[missing], 'missing values')
+
+  zips = normalize_zip(columns['ma-zip'])
+  bad_zip = pc.is_null(zips).to_numpy(zero_copy_only=False) & ~missing
+  _add_issues(report, lines[bad_zip], 'invalid zip')
+  columns['ma-zip'] = pc.coalesce(zips, columns['ma-zip'])
+
+  valid = ~(missing | bad_zip)
+  selection = pa.array(valid)
+  keys = pc.binary_join_element_wise(*(pc.filter(values, selection) for values in columns.values()), KEY_SEPARATOR)
+  codes = keys.combine_chunks().dictionary_encode().indices.to_numpy(zero_copy_only=False)
+  duplicate = pd.Series(codes).duplicated().to_numpy()
+  valid_rows = np.flatnonzero(valid)
+  _add_issues(report, lines[valid_rows[duplicate]], 'duplicate')
+
+  report.keep = valid
+  report.keep[valid_rows[duplicate]] = False
+  report.clean_rows = int(report.keep.sum())
+  progress(4, 4, "Checked")
+  return report
+
+
+def clean_csv(csv_bytes, report):
+  """
+  The rows report kept, normalized, as UTF-8 CSV. The file is streamed in
+  blocks, so this stays out of the report and runs in the upload job.
+  """
+  reader = pv.open_csv(
+    io.BytesIO(csv_bytes),
+    read_options=_read_options(report.encoding),
+    parse_options=_parse_options([]),
+    convert_options=_convert_options(report.raw_columns),
+  )
+  output = io.BytesIO()
+  writer = None
+  start = 0
+  for batch in reader:
+    keep = report.keep[start:start + batch.num_rows]
+    start += batch.num_rows
+    table = pa.Table.from_batches([batch]).rename_columns(report.columns).filter(pa.array(keep))
+    columns = normalize(table)
+    columns['ma-zip'] = pc.coalesce(normalize_zip(columns['ma-zip']), columns['ma-zip'])
+    for i, name in enumerate(table.column_names):
+      values = columns[name] if name in columns else pc.utf8_trim_whitespace(table[name])
+      table = table.set_column(i, name, values)
+    if writer is None:
+      writer = pv.CSVWriter(output, table.schema)
+    writer.write_table(table)
+  if writer is None:
+    return ','.join(report.columns).encode('utf-8') + b'\n'
+  writer.close()
+  return output.getvalue()
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+
+import streamlit as st
+
+
+QR_CACHE_ROOT = os.environ.get('QR_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'qr_cache'))
+QR_CACHE_MAX_BYTES = int(os.environ.get('QR_CACHE_MAX_BYTES', 512 * 1024 ** 2))
+# Eviction trims the cache down to this share of its budget
+QR_CACHE_LOW_WATER = 0.9
+
+
+class QRCache:
+  """
+  Rendered QR images on disk, addressed by the hash of the url and the
+  render parameters. Hits refresh the file's mtime so eviction drops the
+  least recently used images once the cache grows past its budget.
+  """
+
+  def __init__(self, root=QR_CACHE_ROOT, max_bytes=QR_CACHE_MAX_BYTES):
+    self.root = root
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self._lock = threading.Lock()
+    os.makedirs(self.root, exist_ok=True)
+    self._size = sum(size for _, size, _ in self._entries())
+
+  @staticmethod
+  def key(url, scale, border, kind):
+    return hashlib.sha256(f'{kind}\0{scale}\0{border}\0{url}'.encode('utf-8')).hexdigest()
+
+  def _path(self, key, kind):
+    return os.path.join(self.root, key[:2], f'{key}.{kind}')
+
+  def _entries(self):
+    for dirpath, _, filenames in os.walk(self.root):
+      for filename in filenames:
+        path = os.path.join(dirpath, filename)
+        try:
+          stat = os.stat(path)
+        except OSError:
+          continue
+        yield stat.st_mtime, stat.st_size, path
+
+  def get(self, url, scale, border, kind='png'):
+    path = self._path(self.key(url, scale, border, kind), kind)
+    try:
+      with open(path, 'rb') as fp:
+        data = fp.read()
+      os.utime(path)
+    except FileNotFoundError:
+      self.misses += 1
+      return None
+    self.hits += 1
+    return data
+
+  def put(self, url, scale, border, data, kind='png'):
+    path = self._path(self.key(url, scale, border, kind), kind)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'wb') as fp:
+      fp.write(data)
+    os.replace(tmp_path, path)
+    with self._lock:
+      self._size += len(data)
+      if self._size > self.max_bytes:
+        self._evict()
+
+  def _evict(self):
+    entries = sorted(self._entries())
+    self._size = sum(size for _, size, _ in entries)
+    target = self.max_bytes * QR_CACHE_LOW_WATER
+    for _, size, path in entries:
+      if self._size <= target:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        continue
+      self._size -= size
+
+
+@st.cache_resource
+def get_qr_cache():
+  return QRCache()
@@ -0,0 +1,110 @@
+import multiprocessing
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from os import cpu_count
+
+from qr_raster import render_pngs
+
+
+QR_SCALE = 10
+QR_BORDER = 1
+# zlib level for the PNGs, 9 matches segno's own output byte for byte
+QR_COMPRESSLEVEL = 9
+# URLs per task sent to a worker process
+BATCH_SIZE = 256
+# Below this many codes the pool start-up costs more than it saves
+POOL_THRESHOLD = 500
+TRACKABLE_URL_COL = 'o.rp.trackableurl'
+QRCODE_IMG_COL = 'o.rp.qrcode_img'
+
+
+def _render_batch(batch):
+  pngs = render_pngs(
+    [url for _, url in batch], scale=QR_SCALE, border=QR_BORDER, compresslevel=QR_COMPRESSLEVEL
+  )
+  return [(name, png) for (name, _), png in zip(batch, pngs)]
+
+
+def _batched(iterable, size):
+  it = iter(iterable)
+  while batch := list(islice(it, size)):
+    yield batch
+
+
+def qr_entries(dataframe):
+  """(image name, url) pairs for every row that got a trackable url"""
+  names = dataframe[QRCODE_IMG_COL].tolist()
+  urls = dataframe[TRACKABLE_URL_COL].tolist()
+  return [(name, url) for name, url in zip(names, urls) if url != 'Error']
+
+
+def _split_cached(batch, cache):
+  """Returns cached images by position and the entries still to render"""
+  if cache is None:
+    return {}, batch
+  hits = {}
+  misses = []
+  for pos, (name, url) in enumerate(batch):
+    png = cache.get(url, QR_SCALE, QR_BORDER)
+    if png is None:
+      misses.append((name, url))
+    else:
+      hits[pos] = (name, png)
+  return hits, misses
+
+
+def _merge_cached(batch, hits, rendered, cache):
+  rendered = iter(rendered)
+  for pos, (name, url) in enumerate(batch):
+    if pos in hits:
+      yield hits[pos]
+    else:
+      name, png = next(rendered)
+      if cache is not None:
+        cache.put(url, QR_SCALE, QR_BORDER, png)
+      yield name, png
+
+
+def render_qr_codes(entries, workers=None, cache=None):
+  """
+  Yields (name, png bytes) in input order, rendering across a process pool.
+  Images found in the cache are reused and new ones are added to it.
+  """
+  if len(entries) < POOL_THRESHOLD:
+    for batch in _batched(entries, BATCH_SIZE):
+      hits, misses = _split_cached(batch, cache)
+      yield from _merge_cached(batch, hits, _render_batch(misses), cache)
+    return
+
+  workers = workers or cpu_count() or 1
+  # Streamlit runs scripts in threads, so don't fork the server process
+  ctx = multiprocessing.get_context('forkserver')
+  with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+    # Keep a bounded number of batches in flight so finished images are
+    # written out instead of piling up in memory
+    pending = deque()
+    for batch in _batched(entries, BATCH_SIZE):
+      hits, misses = _split_cached(batch, cache)
+      future = pool.submit(_render_batch, misses) if misses else None
+      pending.append((batch, hits, future))
+      if len(pending) >= workers * 2:
+        batch, hits, future = pending.popleft()
+        yield from _merge_cached(batch, hits, future.result() if future else [], cache)
+    while pending:
+      batch, hits, future = pending.popleft()
+      yield from _merge_cached(batch, hits, future.result() if future else [], cache)
+
+
+def write_qr_codes(zipf, entries, folder='qr_codes', workers=None, cache=None):
+  for name, png in render_qr_codes(entries, workers=workers, cache=cache):
+    # PNGs are already deflated, storing them avoids a second compression pass
+    zipf.writestr(f'{folder}/{name}', png, compress_type=zipfile.ZIP_STORED)
+
+
+def export_bulk_results(fileobj, dataframe, workers=None, cache=None):
+  """Writes the processed contacts CSV and every QR code into one zip"""
+  with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as zipf:
+    zipf.writestr('processed_contacts.csv', dataframe.to_csv(index=False))
+    write_qr_codes(zipf, qr_entries(dataframe), workers=workers, cache=cache)
@@ -0,0 +1,198 @@
+import zlib
+import zipfile
+from xml.sax.saxutils import escape
+
+import segno
+
+from qr_export import TRACKABLE_URL_COL
+
+
+# US Letter in points, 2 x 5 labels of 4" x 2" with half inch side margins
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+COLUMNS = 2
+ROWS = 5
+MARGIN_X = 18
+MARGIN_Y = 36
+LABEL_WIDTH = (PAGE_WIDTH - 2 * MARGIN_X) / COLUMNS
+LABEL_HEIGHT = (PAGE_HEIGHT - 2 * MARGIN_Y) / ROWS
+QR_SIZE = 108
+QR_BORDER = 1
+FONT_SIZE = 9
+LINE_HEIGHT = 12
+MERGE_FIELDS = ('envelope_name', 'greeting_name', 'ma-addr_line1')
+
+
+def _field(record, name):
+  value = record.get(name)
+  # Missing cells come back from pandas as NaN
+  if value is None or value != value:
+    return ''
+  return str(value).strip()
+
+
+def label_lines(record):
+  lines = [_field(record, field) for field in MERGE_FIELDS]
+  city = ', '.join(value for value in (_field(record, 'ma-city'), _field(record, 'ma-state')) if value)
+  lines.append(f"{city} {_field(record, 'ma-zip')}".strip())
+  return [line for line in lines if line]
+
+
+def module_runs(code):
+  """(column, row, length) for every horizontal run of dark modules"""
+  for y, row in enumerate(code.matrix):
+    x = 0
+    size = len(row)
+    while x < size:
+      if row[x]:
+        start = x
+        while x < size and row[x]:
+          x += 1
+        yield start, y, x - start
+      else:
+        x += 1
+
+
+def iter_labels(dataframe, chunk_rows=1000):
+  """Yields (qr code, text lines) one row at a time"""
+  for start in range(0, len(dataframe), chunk_rows):
+    chunk = dataframe.iloc[start:start + chunk_rows]
+    for record in chunk.to_dict('records'):
+      url = record.get(TRACKABLE_URL_COL)
+      if not url or url == 'Error':
+        continue
+      yield segno.make_qr(url), label_lines(record)
+
+
+def iter_pages(labels, per_page=COLUMNS * ROWS):
+  page = []
+  for label in labels:
+    page.append(label)
+    if len(page) == per_page:
+      yield page
+      page = []
+  if page:
+    yield page
+
+
+def label_origin(slot):
+  """Top left corner of a label slot, y measured from the top of the page"""
+  column, row = slot % COLUMNS, slot // COLUMNS
+  return MARGIN_X + column * LABEL_WIDTH, MARGIN_Y + row * LABEL_HEIGHT
+
+
+def _pdf_text(value):
+  text = value.encode('cp1252', 'replace')
+  return text.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def _pdf_page_content(page):
+  ops = []
+  for slot, (code, lines) in enumerate(page):
+    left, top = label_origin(slot)
+    size = code.symbol_size(scale=1, border=QR_BORDER)[0]
+    module = QR_SIZE / size
+    qr_left = left + 9
+    qr_top = PAGE_HEIGHT - top - (LABEL_HEIGHT - QR_SIZE) / 2
+    for x, y, length in module_runs(code):
+      ops.append(
+        f'{qr_left + (x + QR_BORDER) * module:.2f} {qr_top - (y + QR_BORDER + 1) * module:.2f} '
+        f'{length * module:.2f} {module:.2f} re'.encode('ascii')
+      )
+    ops.append(b'f')
+    # ' moves down a line before showing text, so the first line lands at qr_top - 16
+    ops.append(f'BT /F1 {FONT_SIZE} Tf {LINE_HEIGHT} TL {qr_left + QR_SIZE + 12:.2f} {qr_top - 4:.2f} Td'.encode('ascii'))
+    for line in lines:
+      ops.append(b'(' + _pdf_text(line) + b") '")
+    ops.append(b'ET')
+  return zlib.compress(b'\n'.join(ops))
+
+
+class _PdfWriter:
+  """Minimal incremental PDF writer, objects go to the file as soon as they are made"""
+
+  def __init__(self, fileobj):
+    self.fileobj = fileobj
+    self.offsets = {}
+    self.position = 0
+    self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+  def _write(self, data):
+    self.fileobj.write(data)
+    self.position += len(data)
+
+  def object(self, number, body):
+    self.offsets[number] = self.position
+    self._write(f'{number} 0 obj\n'.encode('ascii') + body + b'\nendobj\n')
+
+  def stream(self, number, data):
+    head = f'<< /Length {len(data)} /Filter /FlateDecode >>\nstream\n'.encode('ascii')
+    self.object(number, head + data + b'\nendstream')
+
+  def close(self, root):
+    xref_position = self.position
+    count = max(self.offsets) + 1
+    lines = [f'xref\n0 {count}\n0000000000 65535 f \n']
+    lines += [f'{self.offsets[n]:010d} 00000 n \n' for n in range(1, count)]
+    lines.append(f'trailer\n<< /Size {count} /Root {root} 0 R >>\nstartxref\n{xref_position}\n%%EOF\n')
+    self._write(''.join(lines).encode('ascii'))
+
+
+def write_pdf_sheets(fileobj, dataframe):
+  """Streams imposed label sheets as one vector PDF, a page at a time"""
+  pdf = _PdfWriter(fileobj)
+  catalog, pages_ref, font = 1, 2, 3
+  pdf.object(font, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+  kids = []
+  number = font
+  for page in iter_pages(iter_labels(dataframe)):
+    content, number = number + 1, number + 2
+    pdf.stream(content, _pdf_page_content(page))
+    pdf.object(number, (
+      f'<< /Type /Page /Parent {pages_ref} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+      f'/Resources << /Font << /F1 {font} 0 R >> >> /Contents {content} 0 R >>'
+    ).encode('ascii'))
+    kids.append(number)
+  kids_refs = ' '.join(f'{kid} 0 R' for kid in kids)
+  pdf.object(pages_ref, f'<< /Type /Pages /Kids [{kids_refs}] /Count {len(kids)} >>'.encode('ascii'))
+  pdf.object(catalog, f'<< /Type /Catalog /Pages {pages_ref} 0 R >>'.encode('ascii'))
+  pdf.close(catalog)
+
+
+def svg_sheet(page):
+  parts = [
+    f'<svg xmlns="http://www.w3.org/2000/svg" width="{PAGE_WIDTH}pt" height="{PAGE_HEIGHT}pt" '
+    f'viewBox="0 0 {PAGE_WIDTH} {PAGE_HEIGHT}">'
+  ]
+  for slot, (code, lines) in enumerate(page):
+    left, top = label_origin(slot)
+    size = code.symbol_size(scale=1, border=QR_BORDER)[0]
+    module = QR_SIZE / size
+    qr_left = left + 9
+    qr_top = top + (LABEL_HEIGHT - QR_SIZE) / 2
+    path = ''.join(f'M{x + QR_BORDER} {y + QR_BORDER}h{length}v1h-{length}z' for x, y, length in module_runs(code))
+    parts.append(f'<path transform="translate({qr_left:.2f} {qr_top:.2f}) scale({module:.4f})" d="{path}"/>')
+    parts.append(f'<text x="{qr_left + QR_SIZE + 12:.2f}" y="{qr_top + 16:.2f}" font-family="Helvetica" font-size="{FONT_SIZE}">')
+    for pos, line in enumerate(lines):
+      dy = 0 if pos == 0 else LINE_HEIGHT
+      parts.append(f'<tspan x="{qr_left + QR_SIZE + 12:.2f}" dy="{dy}">{escape(line)}</tspan>')
+    parts.append('</text>')
+  parts.append('</svg>')
+  return ''.join(parts)
+
+
+def write_svg_sheets(zipf, dataframe, folder='sheets'):
+  """Streams one SVG per sheet into an open zip"""
+  for number, page in enumerate(iter_pages(iter_labels(dataframe)), 1):
+    zipf.writestr(f'{folder}/sheet_{number:05d}.svg', svg_sheet(page))
+
+
+def export_print_sheets(fileobj, dataframe, kind='pdf'):
+  """Writes the processed contacts CSV and the imposed sheets into one zip"""
+  with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as zipf:
+    zipf.writestr('processed_contacts.csv', dataframe.to_csv(index=False))
+    if kind == 'svg':
+      write_svg_sheets(zipf, dataframe)
+    else:
+      with zipf.open('print_sheets.pdf', 'w') as pdf:
+        write_pdf_sheets(pdf, dataframe)
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+
+
+import pandas as pd
+
+from api_client import get_client
+from schema import STRING
+from tenant_cache import sizeof
+
+
+PAGE_SIZE = 100
+# Pages kept per source, the least recently viewed go first
+MAX_CACHED_PAGES = 50
+
+
+def fetch_records(host, secret_key):
+  """All records of a secret key, as one compacted and revalidated frame"""
+  return get_client().get_frame(host, 'records', params={'secret_key': secret_key}, schema='records')
+
+
+class RecordsSource:
+  """
+  Paged view over a user's /records for the grid.
+
+  The record set is fetched once and kept on the server, the browser only
+  ever receives the page being looked at. Sorted and filtered views are
+  computed once per (sort, filter) and their pages cached, so paging back
+  and forth or rerunning the script never touches the full frame again.
+  """
+
+  def __init__(self, host, secret_key, page_size=PAGE_SIZE):
+    self.host = host
+    self.secret_key = secret_key
+    self.page_size = page_size
+    self._frame = None
+    self._frame_bytes = 0
+    self._version = None
+    self._view_key = None
+    self._view = None
+    self._pages = OrderedDict()
+    # Searchable text of columns that aren't text already, made on first search
+    self._text = {}
+
+  def _load(self):
+    if self._frame is None:
+      self._frame = fetch_records(self.host, self.secret_key)
+      self._frame_bytes = sizeof(self._frame)
+    return self._frame
+
+  @property
+  def nbytes(self):
+    """Memory this source holds, with the fetched frame unless the revalidation cache keeps it too"""
+    size = sum(sizeof(page) for page in self._pages.values()) + sum(sizeof(text) for text in self._text.values())
+    if self._frame is not None and not get_client().holds(self.host, self.secret_key, self._frame):
+      size += self._frame_bytes
+    if self._view is not None and self._view is not self._frame:
+      size += sizeof(self._view)
+    return size
+
+  def __getstate__(self):
+    # Spilled without its frames, they're fetched (or revalidated) and derived again
+    state = self.__dict__.copy()
+    state.update(_frame=None, _frame_bytes=0, _version=None, _view_key=None, _view=None, _pages=OrderedDict(), _text={})
+    return state
+
+  def _contains(self, name, search):
+    column = self._frame[name]
+    if isinstance(column.dtype, pd.CategoricalDtype):
+      # Each distinct value is searched once, rows match by category
+      categories = column.cat.categories
+      return column.isin(categories[categories.astype(str).str.contains(search, case=False, regex=False)])
+    if column.dtype != STRING:
+      if name not in self._text:
+        if isinstance(column.dtype, pd.DatetimeTZDtype):
+          # ISO text like the API sent, numpy formats it far faster than pandas
+          text = column.dt.tz_convert(None).to_numpy().astype('datetime64[s]').astype(str)
+          self._text[name] = pd.Series(text, index=column.index, dtype=STRING)
+        else:
+          self._text[name] = column.astype(str).astype(STRING)
+      column = self._text[name]
+    return column.str.contains(search, case=False, regex=False).fillna(False).astype(bool)
+
+  @property
+  def columns(self):
+    return self._load().columns.tolist()
+
+  def _filtered(self, sort, descending, search):
+    key = (sort, descending, search)
+    if self._view_key != key:
+      view = self._load()
+      if search:
+        mask = pd.Series(False, index=view.index)
+        for name in view.columns:
+          mask |= self._contains(name, search)
+        view = view[mask]
+      if sort:
+        # API columns can mix types, compare those as text
+        view = view.sort_values(
+          sort,
+          ascending=not descending,
+          kind='stable',
+          key=lambda col: col.astype(str) if col.dtype == object else col
+        )
+      self._view_key = key
+      self._view = view
+    return self._view
+
+  def count(self, sort=None, descending=False, search=None):
+    return len(self._filtered(sort, descending, search))
+
+  def page_count(self, sort=None, descending=False, search=None):
+    return max(1, -(-self.count(sort, descending, search) // self.page_size))
+
+  def page(self, number, sort=None, descending=False, search=None):
+    key = (number, sort, descending, search)
+    if key in self._pages:
+      self._pages.move_to_end(key)
+      return self._pages[key]
+    start = number * self.page_size
+    page = self._filtered(sort, descending, search).iloc[start:start + self.page_size].reset_index(drop=True)
+    self._pages[key] = page
+    while len(self._pages) > MAX_CACHED_PAGES:
+      self._pages.popitem(last=False)
+    return page
+
+  def frame(self):
+    return self._load()
+
+  def version(self):
+    """Hash of the fetched records, the same for the same data. Computed once per fetch"""
+    if self._version is None:
+      self._version = f'{pd.util.hash_pandas_object(self._load(), index=False, categorize=False).sum():016x}'
+    return self._version
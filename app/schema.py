@@ -0,0 +1,81 @@
+import pandas as pd
+
+
+STRING = 'string[pyarrow]'
+# Text columns with fewer distinct values than this share of rows become categories
+CATEGORY_RATIO = 0.5
+
+# Declared column types per endpoint, anything else is inferred
+SCHEMAS = {
+  'records': {
+    'id': STRING,
+    'short_url': STRING,
+    'timestamp': 'datetime',
+    'campaign': 'category',
+    'destination_url': 'category',
+  },
+  'logs': {
+    'path': STRING,
+    'timestamp': 'datetime',
+    'ip': 'category',
+    'user_agent': 'category',
+  },
+}
+SCHEMAS['related'] = SCHEMAS['logs']
+
+
+def _is_text(column):
+  values = column.dropna()
+  return not values.empty and values.map(type).eq(str).all()
+
+
+def _convert(column, kind):
+  if kind == 'datetime':
+    return pd.to_datetime(column, errors='coerce', utc=True)
+  if kind == 'category':
+    return column.astype('category')
+  return column.astype(kind)
+
+
+def _infer(column):
+  if pd.api.types.is_integer_dtype(column.dtype) and not isinstance(column.dtype, pd.CategoricalDtype):
+    return pd.to_numeric(column, downcast='integer')
+  if pd.api.types.is_float_dtype(column.dtype):
+    return pd.to_numeric(column, downcast='float')
+  if column.dtype != object or not _is_text(column):
+    # Nested payloads (dicts, lists) and mixed columns stay as they are
+    return column
+  if column.nunique() < len(column) * CATEGORY_RATIO:
+    return column.astype('category')
+  return column.astype(STRING)
+
+
+def memory(df):
+  return int(df.memory_usage(deep=True).sum())
+
+
+def compact(df, endpoint=None):
+  """
+  Typed copy of an API payload frame: declared columns get their endpoint
+  type, repetitive text becomes categorical, other text Arrow strings and
+  numbers are downcast. df.attrs['memory'] holds the bytes before and after.
+  """
+  schema = SCHEMAS.get(endpoint, {})
+  # Re-typing a compacted frame keeps the size it had as parsed
+  before = df.attrs.get('memory', {}).get('before') or memory(df)
+  typed = {}
+  for name in df.columns:
+    column = df[name]
+    kind = schema.get(name)
+    typed[name] = _convert(column, kind) if kind else _infer(column)
+  out = pd.DataFrame(typed, index=df.index)
+  out.attrs['memory'] = {'before': before, 'after': memory(out)}
+  return out
+
+
+def memory_note(df):
+  """'2.1 MB in memory, 9.8 MB untyped' for a frame made by compact()"""
+  report = df.attrs.get('memory')
+  if not report:
+    return None
+  return f"{report['after'] / 1e6:.1f} MB in memory, {report['before'] / 1e6:.1f} MB untyped"
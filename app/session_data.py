@@ -0,0 +1,183 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+import traceback
+import uuid
+import weakref
+
+import streamlit as st
+
+from artifacts import get_store
+from tenant_cache import sizeof
+
+
+# Bytes of large values one session keeps in memory before spilling to disk
+SESSION_MEMORY_BYTES = int(os.environ.get('SESSION_MEMORY_BYTES', 256 * 1024 * 1024))
+# Same, summed over every session of the container
+SESSION_MEMORY_TOTAL_BYTES = int(os.environ.get('SESSION_MEMORY_TOTAL_BYTES', 1024 ** 3))
+# Values smaller than this are never worth a round trip to disk
+SPILL_MIN_BYTES = 64 * 1024
+
+
+class _Entry:
+  __slots__ = ('value', 'size', 'spilled', 'used')
+
+  def __init__(self, value, size):
+    self.value = value
+    self.size = size
+    self.spilled = False
+    self.used = time.monotonic()
+
+
+class SessionData:
+  """
+  Dict-like home for a session's large values (frames, record sources,
+  parsed uploads). Values are sized when stored; when the session or the
+  container goes over budget the least recently used ones are pickled to
+  the artifact store and read back on their next access.
+  """
+
+  def __init__(self, manager, owner):
+    self.owner = owner
+    self.resident = 0
+    self._manager = manager
+    self._entries = {}
+    self._lock = threading.RLock()
+
+  def _file(self, key):
+    return f"{hashlib.sha1(repr(key).encode('utf-8')).hexdigest()}.pkl"
+
+  def __contains__(self, key):
+    return key in self._entries
+
+  def get(self, key, default=None):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return default
+      if entry.spilled:
+        path = get_store().path(self.owner, self._file(key))
+        if path is None:
+          # The spill file was evicted with the other artifacts, the value is gone
+          del self._entries[key]
+          return default
+        with open(path, 'rb') as fp:
+          entry.value = pickle.load(fp)
+        entry.spilled = False
+        self.resident += entry.size
+      entry.used = time.monotonic()
+      value = entry.value
+      if hasattr(value, 'nbytes') and not hasattr(value, 'memory_usage'):
+        # Objects that cache as they're used, like RecordsSource, grow after being stored
+        self.resident += value.nbytes - entry.size
+        entry.size = value.nbytes
+    self._manager.enforce(self, keep=key)
+    return value
+
+  def __getitem__(self, key):
+    if key not in self._entries:
+      raise KeyError(key)
+    return self.get(key)
+
+  def __setitem__(self, key, value):
+    entry = _Entry(value, sizeof(value) if value is not None else 0)
+    with self._lock:
+      self._drop(key)
+      self._entries[key] = entry
+      self.resident += entry.size
+    self._manager.enforce(self, keep=key)
+
+  def pop(self, key, default=None):
+    value = self.get(key, default)
+    with self._lock:
+      self._drop(key)
+    return value
+
+  def _drop(self, key):
+    entry = self._entries.pop(key, None)
+    if entry is not None and not entry.spilled:
+      self.resident -= entry.size
+
+  def spillable(self, keep=None):
+    """(last used, key, size) of resident values big enough to spill"""
+    with self._lock:
+      return [
+        (entry.used, key, entry.size) for key, entry in self._entries.items()
+        if not entry.spilled and entry.size >= SPILL_MIN_BYTES and key != keep
+      ]
+
+  def spill(self, key):
+    """Writes one value to disk and releases it, returns the bytes freed"""
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None or entry.spilled:
+        return 0
+      try:
+        with get_store().create(self.owner, self._file(key)) as fp:
+          pickle.dump(entry.value, fp, protocol=pickle.HIGHEST_PROTOCOL)
+      except Exception:
+        # Unpicklable or over the disk quota, the value stays in memory
+        traceback.print_exc()
+        return 0
+      entry.value = None
+      entry.spilled = True
+      self.resident -= entry.size
+      return entry.size
+
+
+class SessionDataManager:
+  def __init__(self, session_budget=SESSION_MEMORY_BYTES, total_budget=SESSION_MEMORY_TOTAL_BYTES):
+    self.session_budget = session_budget
+    self.total_budget = total_budget
+    self._sessions = weakref.WeakSet()
+    self._lock = threading.Lock()
+
+  def session(self):
+    data = SessionData(self, f'session-{uuid.uuid4().hex}')
+    with self._lock:
+      self._sessions.add(data)
+    # Spill files go when the session's state does
+    weakref.finalize(data, get_store().remove, data.owner)
+    return data
+
+  @property
+  def resident(self):
+    with self._lock:
+      sessions = list(self._sessions)
+    return sum(data.resident for data in sessions)
+
+  def enforce(self, data, keep=None):
+    """Spills least recently used values, first of this session, then of all sessions"""
+    over = data.resident - self.session_budget
+    for _, key, _ in sorted(data.spillable(keep)):
+      if over <= 0:
+        break
+      over -= data.spill(key)
+
+    with self._lock:
+      sessions = list(self._sessions)
+    over = sum(session.resident for session in sessions) - self.total_budget
+    if over <= 0:
+      return
+    candidates = [
+      (used, session, key) for session in sessions
+      for used, key, _ in session.spillable(keep if session is data else None)
+    ]
+    for _, session, key in sorted(candidates, key=lambda candidate: candidate[0]):
+      if over <= 0:
+        break
+      over -= session.spill(key)
+
+
+@st.cache_resource
+def get_session_manager():
+  return SessionDataManager()
+
+
+def get_session_data():
+  """The current session's SessionData"""
+  if 'session_data' not in st.session_state:
+    st.session_state['session_data'] = get_session_manager().session()
+  return st.session_state['session_data']
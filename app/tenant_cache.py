@@ -0,0 +1,187 @@
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import streamlit as st
+
+
+_MISSING = object()
+
+
+def sizeof(value):
+  """Approximate bytes held by a cached value"""
+  # pandas is only loaded by the pages that need it, and no value can be a
+  # pandas object before it is
+  pd = sys.modules.get('pandas')
+  if pd is not None and isinstance(value, pd.DataFrame):
+    return int(value.memory_usage(deep=True).sum())
+  if pd is not None and isinstance(value, (pd.Series, pd.Index)):
+    return int(value.memory_usage(deep=True))
+  if hasattr(value, 'nbytes'):
+    return int(value.nbytes)
+  if isinstance(value, (bytes, bytearray, str)):
+    return len(value)
+  try:
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+  except Exception:
+    return sys.getsizeof(value)
+
+
+class TenantCache:
+  """
+  LRU cache whose keys are namespaced by tenant (a secrets group).
+
+  Entries expire after ttl seconds, and the least recently used ones are
+  evicted once the cache holds more than max_entries or max_bytes.
+  invalidate(tenant) drops one tenant's entries and leaves the rest alone.
+  """
+
+  def __init__(self, name, ttl, max_entries, max_bytes):
+    self.name = name
+    self.ttl = ttl
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.bytes = 0
+    # (tenant, key) -> (expires, size, value)
+    self._entries = OrderedDict()
+    self._lock = threading.RLock()
+
+  def _drop(self, full_key):
+    self.bytes -= self._entries.pop(full_key)[1]
+
+  def get(self, tenant, key, default=None):
+    full_key = (tenant, key)
+    with self._lock:
+      entry = self._entries.get(full_key)
+      if entry is not None and entry[0] <= time.monotonic():
+        self._drop(full_key)
+        entry = None
+      if entry is None:
+        self.misses += 1
+        return default
+      self.hits += 1
+      self._entries.move_to_end(full_key)
+      return entry[2]
+
+  def put(self, tenant, key, value, size=None):
+    full_key = (tenant, key)
+    size = sizeof(value) if size is None else size
+    with self._lock:
+      if full_key in self._entries:
+        self._drop(full_key)
+      self._entries[full_key] = (time.monotonic() + self.ttl, size, value)
+      self.bytes += size
+      self._evict()
+    return value
+
+  def get_or_load(self, tenant, key, load):
+    value = self.get(tenant, key, _MISSING)
+    if value is _MISSING:
+      value = self.put(tenant, key, load())
+    return value
+
+  def remeasure(self, tenant, key):
+    """Updates the size of an entry whose value grew after it was stored"""
+    full_key = (tenant, key)
+    with self._lock:
+      entry = self._entries.get(full_key)
+      if entry is None:
+        return
+      size = sizeof(entry[2])
+      self._entries[full_key] = (entry[0], size, entry[2])
+      self.bytes += size - entry[1]
+      self._evict()
+
+  def holds(self, tenant, match):
+    """Whether an unexpired entry of tenant has a value for which match(value) is true"""
+    now = time.monotonic()
+    with self._lock:
+      return any(
+        entry[0] > now and match(entry[2]) for full_key, entry in self._entries.items() if full_key[0] == tenant
+      )
+
+  def discard(self, tenant, key, value=_MISSING):
+    """Drops an entry, only while it still holds value when one is given"""
+    full_key = (tenant, key)
+    with self._lock:
+      entry = self._entries.get(full_key)
+      if entry is not None and (value is _MISSING or entry[2] is value):
+        self._drop(full_key)
+
+  def _evict(self):
+    now = time.monotonic()
+    for full_key in [k for k, entry in self._entries.items() if entry[0] <= now]:
+      self._drop(full_key)
+    while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+      self._drop(next(iter(self._entries)))
+      self.evictions += 1
+
+  def invalidate(self, tenant):
+    with self._lock:
+      for full_key in [k for k in self._entries if k[0] == tenant]:
+        self._drop(full_key)
+
+  def stats(self):
+    with self._lock:
+      return {
+        'cache': self.name,
+        'entries': len(self._entries),
+        'bytes': self.bytes,
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+      }
+
+
+class CacheRegistry:
+  def __init__(self):
+    self._caches = {}
+    self._lock = threading.Lock()
+
+  def cache(self, name, ttl, max_entries, max_bytes):
+    with self._lock:
+      if name not in self._caches:
+        self._caches[name] = TenantCache(name, ttl, max_entries, max_bytes)
+      return self._caches[name]
+
+  def invalidate(self, tenant):
+    with self._lock:
+      caches = list(self._caches.values())
+    for cache in caches:
+      cache.invalidate(tenant)
+
+  def stats(self):
+    import pandas as pd
+
+    with self._lock:
+      caches = list(self._caches.values())
+    return pd.DataFrame([cache.stats() for cache in caches])
+
+
+@st.cache_resource
+def get_cache_registry():
+  return CacheRegistry()
+
+
+def get_tenant_cache(name, ttl, max_entries, max_bytes):
+  return get_cache_registry().cache(name, ttl, max_entries, max_bytes)
+
+
+def invalidate_tenant(tenant):
+  """
+  Drops every cached entry of one tenant, in every cache. That includes
+  the revalidated HTTP bodies of the group's backend and secret key.
+  """
+  from api_client import revalidation_tenant
+
+  registry = get_cache_registry()
+  registry.invalidate(tenant)
+  values = st.secrets.get(tenant)
+  if isinstance(values, Mapping) and values.get('HOST'):
+    registry.invalidate(revalidation_tenant(values['HOST'], values.get('SECRET_KEY')))
@@ -0,0 +1,51 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import pandas as pd
+import streamlit as st
+
+from artifacts import ArtifactStore
+
+
+RESULT_INDEX_ROOT = os.environ.get('RESULT_INDEX_DIR', os.path.join(tempfile.gettempdir(), 'bulk_results'))
+RESULT_INDEX_MAX_BYTES = int(os.environ.get('RESULT_INDEX_MAX_BYTES', 1024 ** 3))
+RESULT_INDEX_TTL = int(os.environ.get('RESULT_INDEX_TTL', 30 * 24 * 60 * 60))
+# Pickle round-trips the API's mixed-type columns exactly, files are only ever written by us
+RESULT_NAME = 'contacts.pkl'
+
+
+def upload_key(host, csv_bytes, payload):
+  """Same file contents for the same campaign on the same backend always map to the same key"""
+  digest = hashlib.sha256(host.encode('utf-8'))
+  digest.update(csv_bytes)
+  digest.update(json.dumps(payload, sort_keys=True).encode('utf-8'))
+  return digest.hexdigest()
+
+
+class ResultIndex:
+  """Processed /bulk results on disk, keyed by upload_key()"""
+
+  def __init__(self, store):
+    self.store = store
+
+  def get(self, key):
+    path = self.store.path(key, RESULT_NAME)
+    if path is None:
+      return None
+    return pd.read_pickle(path)
+
+  def put(self, key, df):
+    with self.store.create(key, RESULT_NAME) as fp:
+      df.to_pickle(fp)
+
+
+@st.cache_resource
+def get_result_index():
+  return ResultIndex(ArtifactStore(
+    root=RESULT_INDEX_ROOT,
+    max_bytes=RESULT_INDEX_MAX_BYTES,
+    max_workspace_bytes=RESULT_INDEX_MAX_BYTES,
+    ttl=RESULT_INDEX_TTL
+  ))
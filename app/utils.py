@@ -1,6 +1,8 @@
 import streamlit as st
 import os
 
+from warmup import get_cache_warmer
+
 
 def display_sidebar():
 
@@ -42,3 +44,7 @@ def display_sidebar():
     #   label="View Activity",
     #   use_container_width=True,
     # )
+
+  # Every page shows the sidebar, so the first page run of the process
+  # starts warming every tenant's caches
+  get_cache_warmer()
@@ -0,0 +1,106 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import streamlit as st
+
+from analytics import visits_frame
+from api_client import run_in_background
+from campaign_summary import fetch_contacts, fetch_visits
+from tenant_cache import get_tenant_cache, sizeof
+
+
+# Campaign data is fetched again after this many seconds
+PREFETCH_TTL = 300
+PREFETCH_WORKERS = 4
+MAX_CAMPAIGNS = 32
+PREFETCH_MAX_BYTES = int(os.environ.get('PREFETCH_MAX_BYTES', 512 * 1024 * 1024))
+
+
+class VisitIndex:
+  """Visits grouped by path once, so each contact lookup is a dict access"""
+
+  def __init__(self, visits):
+    self.visits = visits
+    self._empty = visits.iloc[0:0]
+    self._by_path = {path: group for path, group in visits.groupby('path', observed=True, sort=False)}
+
+  def get(self, contact_id):
+    return self._by_path.get(str(contact_id), self._empty)
+
+
+class CampaignPrefetch:
+  """Contacts and every contact's /related visits for one campaign, loading in the background"""
+
+  def __init__(self, pool, host, secret_key, campaign):
+    # Contacts resolve as soon as they arrive, before the visits are in
+    self._contacts = Future()
+    self._index = pool.submit(self._load, host, secret_key, campaign)
+
+  def _load(self, host, secret_key, campaign):
+    try:
+      contacts = fetch_contacts(host, secret_key, campaign)
+    except Exception as e:
+      self._contacts.set_exception(e)
+      raise
+    self._contacts.set_result(contacts)
+    ids = contacts['id'].astype(str).tolist() if 'id' in contacts else []
+    return VisitIndex(fetch_visits(host, secret_key, ids) if ids else visits_frame([]))
+
+  @property
+  def nbytes(self):
+    """Bytes held once loaded, what the prefetch cache budgets against"""
+    size = 0
+    if self._contacts.done() and not self._contacts.exception():
+      size += sizeof(self._contacts.result())
+    if self._index.done() and not self._index.exception():
+      size += sizeof(self._index.result().visits)
+    return size
+
+  def ready(self):
+    """Whether the visits are in or failed to load, index() no longer blocks"""
+    return self._index.done()
+
+  def error(self):
+    return self._index.exception() if self._index.done() else None
+
+  def contacts(self):
+    return self._contacts.result()
+
+  def index(self):
+    return self._index.result()
+
+  def visits(self):
+    return self.index().visits
+
+
+class Prefetcher:
+  def __init__(self):
+    self._pool = ThreadPoolExecutor(
+      max_workers=PREFETCH_WORKERS, thread_name_prefix='prefetch', initializer=run_in_background
+    )
+    self._cache = get_tenant_cache('campaign_prefetch', PREFETCH_TTL, MAX_CAMPAIGNS, PREFETCH_MAX_BYTES)
+    self._lock = threading.Lock()
+
+  def prefetch(self, tenant, host, secret_key, campaign):
+    """Starts loading a campaign if it isn't loaded or loading already"""
+    key = (host, secret_key, campaign)
+    with self._lock:
+      entry = self._cache.get(tenant, key)
+      if entry is None:
+        entry = self._cache.put(tenant, key, CampaignPrefetch(self._pool, host, secret_key, campaign), size=0)
+        entry._index.add_done_callback(lambda future: self._loaded(tenant, key, entry, future))
+      return entry
+
+  def _loaded(self, tenant, key, entry, future):
+    if future.exception() is None:
+      # Sized once the frames are in, so the byte budget sees them
+      self._cache.remeasure(tenant, key)
+    else:
+      # A failed load isn't kept, the next prefetch of the campaign tries again
+      self._cache.discard(tenant, key, entry)
+
+
+@st.cache_resource
+def get_prefetcher():
+  return Prefetcher()
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+import traceback
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from api_client import run_in_background
+from campaign_catalog import get_campaign_catalog
+from tenant_cache import get_cache_registry
+
+
+# Tenant groups warmed at once, each host is further limited by its HostGuard's
+# background slots.
+# 0 turns warming off
+WARM_WORKERS = int(os.environ.get('WARM_WORKERS', 4))
+# Seconds between warming rounds, 0 warms once at start only
+WARM_INTERVAL = int(os.environ.get('WARM_INTERVAL', 5 * 60))
+
+
+def tenant_groups():
+  """group -> (host, secret key) of every secrets group that points at a backend"""
+  try:
+    items = list(st.secrets.items())
+  except FileNotFoundError:
+    return {}
+  return {
+    group: (values['HOST'], values['SECRET_KEY']) for group, values in items
+    if isinstance(values, Mapping) and values.get('HOST') and values.get('SECRET_KEY')
+  }
+
+
+class CacheWarmer:
+  """
+  Fetches the campaign catalog of every tenant group and queues the
+  campaign summaries the dashboard is missing, so the first visit after a
+  deploy finds them ready. A round runs at start and then every interval
+  seconds. Outdated summaries are only rebuilt for recently viewed
+  dashboards, see SummaryRefresher.
+  """
+
+  def __init__(self, workers=WARM_WORKERS, interval=WARM_INTERVAL):
+    self.interval = interval
+    # group -> time its last warming finished
+    self.warmed_at = {}
+    self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='warm', initializer=run_in_background)
+    self._thread = threading.Thread(target=self._run, name='cache-warmer', daemon=True)
+
+  def start(self):
+    self._thread.start()
+    return self
+
+  def warm(self, group, host, secret_key):
+    # Imported here so pandas loads in the background, not in a page's first run
+    from campaign_summary import get_summary_refresher
+
+    # The catalog pages 1, 2 and 4 read for the group
+    campaigns = get_campaign_catalog().refresh(host, secret_key)
+    # The summaries build on their own pool
+    get_summary_refresher().refresh(group, host, secret_key, campaigns, scheduled=True)
+    self.warmed_at[group] = time.time()
+
+  def _warm(self, group, host, secret_key):
+    try:
+      self.warm(group, host, secret_key)
+    except Exception:
+      traceback.print_exc()
+
+  def warm_all(self):
+    futures = [
+      self._pool.submit(self._warm, group, host, secret_key)
+      for group, (host, secret_key) in tenant_groups().items()
+    ]
+    for future in futures:
+      future.result()
+
+  def _run(self):
+    while True:
+      self.warm_all()
+      # Process-wide cache usage in the server log after every round
+      print(f'Cache usage after warming:\n{get_cache_registry().stats().to_string(index=False)}', flush=True)
+      if not self.interval:
+        return
+      time.sleep(self.interval)
+
+
+# Started by the first page run of the process
+@st.cache_resource
+def get_cache_warmer():
+  return CacheWarmer().start() if WARM_WORKERS > 0 else None
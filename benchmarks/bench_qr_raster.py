@@ -0,0 +1,51 @@
+"""
+Throughput of the NumPy QR rasterizer against segno's PNG writer.
+
+Encoding (segno.make_qr) is the same for both paths and is timed on its
+own, the comparison is for turning encoded codes into PNG bytes.
+
+  python benchmarks/bench_qr_raster.py [count]
+"""
+import io
+import os
+import sys
+import time
+
+import segno
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from qr_raster import render_codes  # noqa: E402
+
+
+def segno_pngs(codes, scale=10, border=1):
+  pngs = []
+  for code in codes:
+    buff = io.BytesIO()
+    code.save(buff, kind='png', scale=scale, border=border)
+    pngs.append(buff.getvalue())
+  return pngs
+
+
+def timed(label, fn, count):
+  start = time.perf_counter()
+  result = fn()
+  elapsed = time.perf_counter() - start
+  print(f'{label:<28} {elapsed:8.3f}s  {count / elapsed:10.0f} codes/s')
+  return result
+
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+  urls = [f'https://rp.example.com/q/{i:08x}' for i in range(count)]
+
+  codes = timed('segno.make_qr', lambda: [segno.make_qr(url) for url in urls], count)
+  reference = timed('segno save()', lambda: segno_pngs(codes), count)
+  batched = timed('render_codes level 9', lambda: render_codes(codes), count)
+  assert batched == reference, 'output differs from segno'
+  timed('render_codes level 6', lambda: render_codes(codes, compresslevel=6), count)
+  timed('render_codes level 1', lambda: render_codes(codes, compresslevel=1), count)
+
+
+if __name__ == '__main__':
+  main()
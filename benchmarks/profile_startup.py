@@ -0,0 +1,92 @@
+"""
+Import cost of each page's first run, in the style of python -X importtime.
+
+Every page is run once through streamlit's AppTest in its own interpreter
+started with -X importtime, so each starts as cold as a freshly deployed
+container. Secrets are placeholders and the backend is unreachable, which
+makes the run stop where a page first needs data: what is reported is
+what gets imported before its first paint. Modules that streamlit and
+AppTest import themselves are left out.
+
+  python benchmarks/profile_startup.py [--top N] [page ...] > benchmarks/startup_profile.txt
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+PAGES = ['app.py'] + sorted(f'pages/{name}' for name in os.listdir(os.path.join(APP, 'pages')) if name[0].isdigit())
+MARKER = '-- page run --'
+GROUP = 'profile'
+# Connections to port 9 are refused at once
+BACKEND = 'http://127.0.0.1:9'
+SECRETS = {
+  'host': BACKEND,
+  GROUP: {'HOST': BACKEND, 'SECRET_KEY': 'profile', 'API': BACKEND, 'USER': 'profile', 'PASS': 'profile'},
+}
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)')
+
+
+def run_page(page):
+  """Child process: one AppTest run of page, with a marker before it on stderr"""
+  os.chdir(APP)
+  sys.path.insert(0, APP)
+  # Background warming would import in other threads during the run
+  os.environ['WARM_WORKERS'] = '0'
+  import streamlit as st
+  from streamlit.testing.v1 import AppTest
+
+  # st.page_link needs the multipage runtime AppTest doesn't have
+  st.page_link = lambda *args, **kwargs: None
+
+  at = AppTest.from_file(page, default_timeout=120)
+  at.secrets.update(SECRETS)
+  at.session_state['group'] = GROUP
+  print(MARKER, file=sys.stderr, flush=True)
+  start = time.perf_counter()
+  at.run()
+  print(f'{time.perf_counter() - start:.3f}')
+
+
+def profile(page):
+  """(seconds of the run, [(cumulative us, module)] of top-level imports during it)"""
+  proc = subprocess.run(
+    [sys.executable, '-X', 'importtime', __file__, '--run', page],
+    capture_output=True, text=True, check=True,
+  )
+  imports = []
+  seen = False
+  for line in proc.stderr.splitlines():
+    if line == MARKER:
+      seen = True
+      continue
+    match = LINE.match(line)
+    # Only imports made directly by the run, the nested ones are in their cumulative time
+    if seen and match and match.group(3) == '':
+      imports.append((int(match.group(2)), match.group(4)))
+  return float(proc.stdout.split()[-1]), imports
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('pages', nargs='*', default=PAGES)
+  parser.add_argument('--top', type=int, default=8)
+  parser.add_argument('--run', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+  if args.run:
+    return run_page(args.run)
+
+  print(f'# python {sys.version.split()[0]}, {time.strftime("%Y-%m-%d")}')
+  for page in args.pages:
+    elapsed, imports = profile(page)
+    total = sum(us for us, _ in imports)
+    print(f'\n{page}: first run {elapsed:.2f}s, {total / 1e6:.2f}s of it importing {len(imports)} modules')
+    for us, module in sorted(imports, reverse=True)[:args.top]:
+      print(f'  {us / 1e3:9.1f} ms  {module}')
+
+
+if __name__ == '__main__':
+  main()